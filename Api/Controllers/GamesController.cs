@@ -19,24 +19,41 @@ namespace Api.Controllers
             _context = context;
         }
 
-        // GET: api/Games?player=5
+        // GET: api/Games?player=5&after_id=10&before_id=20&limit=100&order=desc
         [HttpGet]
-        public async Task<ActionResult<IEnumerable<Game>>> GetGames(long? player)
+        public async Task<ActionResult<IEnumerable<Game>>> GetGames(
+            long? player,
+            [FromQuery(Name = "after_id")] long? afterId,
+            [FromQuery(Name = "before_id")] long? beforeId,
+            int? limit,
+            string order)
         {
-            if (player == null)
+            IQueryable<Game> games = _context.Games.Include(x => x.Players);
+            if (player != null)
             {
-                return await _context
-                    .Games
-                    .Include(x => x.Players)
-                    .ToListAsync();
+                games = games.Where(x => x.Players.Any(y => y.Id == player));
             }
-            return await _context
-                .Players
-                .Where(x => x.Id == player)
-                .Include(x => x.Game)
-                .Include(x => x.Game.Players)
-                .Select(x => x.Game)
-                .ToListAsync();
+            if (afterId != null)
+            {
+                games = games.Where(x => x.Id > afterId);
+            }
+            if (beforeId != null)
+            {
+                games = games.Where(x => x.Id < beforeId);
+            }
+            if (order == "desc")
+            {
+                games = games.OrderByDescending(x => x.Id);
+            }
+            else
+            {
+                games = games.OrderBy(x => x.Id);
+            }
+            if (limit != null)
+            {
+                games = games.Take(limit.Value);
+            }
+            return await games.ToListAsync();
         }
 
         // GET: api/Games/5
@@ -67,7 +84,7 @@ namespace Api.Controllers
 
         // PUT: api/Games/5
         [HttpPut("{id}")]
-        public async Task<IActionResult> PutGame(long id, Game game)
+        public async Task<ActionResult<Game>> PutGame(long id, Game game)
         {
             if (id != game.Id)
             {
@@ -101,7 +118,7 @@ namespace Api.Controllers
             }
             await _context.SaveChangesAsync();
 
-            return NoContent();
+            return game;
         }
 
         // POST: api/Games
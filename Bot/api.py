@@ -1,36 +1,84 @@
-import requests
-from typing import Optional, List
+import aiohttp
+from typing import AsyncIterator, Optional, List
 from game import Game
+from metrics import metrics
 
 
 class Api:
-    def __init__(self, url: str):
+    def __init__(self, url: str, timeout: float = 10, connections: int = 10, page_size: int = 1000):
         self.url = url
+        self.page_size = page_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.connections = connections
+        self.session = None
 
-    def get_games(self, player_id: int = None) -> List[Game]:
+    def _session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+    async def iter_games(self, player_id: int = None, after_id: int = None, limit: int = None, newest_first: bool = False) -> AsyncIterator[Game]:
         url = f"{self.url}/games"
         payload = {}
         if player_id:
             payload["player"] = player_id
-        r = requests.get(url, payload)
-        return list(map(Game.from_dict, r.json()))
-
-    def get_game_by_id(self, game_id: int) -> Optional[Game]:
-        r = requests.get(f"{self.url}/games/{game_id}")
-        if r.status_code == 200:
-            return Game.from_dict(r.json())
-        else:
-            return None
-
-    def get_last_game(self) -> Optional[Game]:
-        r = requests.get(f"{self.url}/games/last")
-        if r.status_code == 200:
-            return Game.from_dict(r.json())
-        else:
-            return None
-
-    def create_game(self, game: Game) -> None:
-        requests.post(f"{self.url}/games", json=game.to_dict())
-
-    def update_game(self, game: Game) -> None:
-        requests.put(f"{self.url}/games/{game.id}", json=game.to_dict())
+        if after_id:
+            payload["after_id"] = after_id
+        if newest_first:
+            payload["order"] = "desc"
+        while limit is None or limit > 0:
+            page_size = self.page_size if limit is None else min(
+                self.page_size, limit)
+            payload["limit"] = page_size
+            with metrics.timer("api.iter_games"):
+                async with self._session().get(url, params=payload) as r:
+                    games = list(map(Game.from_dict, await r.json()))
+            for game in games:
+                yield game
+            if len(games) < page_size:
+                return
+            if newest_first:
+                payload["before_id"] = games[-1].id
+            else:
+                payload["after_id"] = games[-1].id
+            if limit is not None:
+                limit -= len(games)
+
+    async def get_games(self, player_id: int = None, after_id: int = None, limit: int = None, newest_first: bool = False) -> List[Game]:
+        return [x async for x in self.iter_games(player_id, after_id, limit, newest_first)]
+
+    @metrics.timed("api.get_game_by_id")
+    async def get_game_by_id(self, game_id: int) -> Optional[Game]:
+        async with self._session().get(f"{self.url}/games/{game_id}") as r:
+            if r.status == 200:
+                return Game.from_dict(await r.json())
+            else:
+                return None
+
+    @metrics.timed("api.get_last_game")
+    async def get_last_game(self) -> Optional[Game]:
+        async with self._session().get(f"{self.url}/games/last") as r:
+            if r.status == 200:
+                return Game.from_dict(await r.json())
+            else:
+                return None
+
+    @metrics.timed("api.create_game")
+    async def create_game(self, game: Game) -> Game:
+        async with self._session().post(f"{self.url}/games", json=game.to_dict()) as r:
+            r.raise_for_status()
+            return Game.from_dict(await r.json())
+
+    @metrics.timed("api.update_game")
+    async def update_game(self, game: Game) -> Game:
+        async with self._session().put(f"{self.url}/games/{game.id}", json=game.to_dict()) as r:
+            r.raise_for_status()
+            if r.status == 204:
+                return game.copy()
+            return Game.from_dict(await r.json())
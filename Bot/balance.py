@@ -0,0 +1,104 @@
+import itertools
+import time
+from functools import lru_cache
+import numpy as np
+from player import env
+
+EXACT_MAX_TEAM_SIZE = 10
+TIME_BUDGET = 0.2
+MAX_TIE_BREAKS = 100
+
+
+@lru_cache(maxsize=32)
+def splits(n: int, size: int) -> np.ndarray:
+    combinations = list(itertools.combinations(range(1, n), size - 1))
+    indices = np.array(combinations, dtype=np.intp).reshape(
+        len(combinations), size - 1)
+    masks = np.zeros((len(combinations), n), dtype=bool)
+    masks[:, 0] = True
+    masks[np.arange(len(combinations))[:, None], indices] = True
+    masks.setflags(write=False)
+    return masks
+
+
+def quality(mu1, mu2, sigma2, n: int):
+    c = n * env.beta ** 2 + sigma2
+    return np.sqrt(n * env.beta ** 2 / c) * np.exp(-(mu1 - mu2) ** 2 / (2 * c))
+
+
+def partial_sums(mus, size: int) -> np.ndarray:
+    # Team 1 sums of every split over all players but the last one, so the
+    # split can be finished in O(splits) when the last player joins.
+    mus = np.asarray(mus, dtype=float)
+    return splits(len(mus) + 1, size)[:, :-1] @ mus
+
+
+def exact(mus: np.ndarray, sigmas: np.ndarray, size: int, partial: np.ndarray = None):
+    n = len(mus)
+    masks = splits(n, size)
+    if partial is None:
+        mu1 = masks @ mus
+    else:
+        mu1 = partial + masks[:, -1] * mus[-1]
+    scores = quality(mu1, mus.sum() - mu1, (sigmas ** 2).sum(), n)
+    candidates = np.flatnonzero(scores >= scores.max() * (1 - 1e-9))
+    best = candidates[0]
+    if 1 < len(candidates) <= MAX_TIE_BREAKS:
+        # Near-ties are decided by env.quality so the chosen split does not
+        # depend on rounding differences between the two formulas.
+        ratings = [env.create_rating(mu, sigma)
+                   for (mu, sigma) in zip(mus, sigmas)]
+        best_score = 0
+        for i in candidates:
+            team1 = [ratings[j] for j in np.flatnonzero(masks[i])]
+            team2 = [ratings[j] for j in np.flatnonzero(~masks[i])]
+            score = env.quality([team1, team2])
+            if score > best_score:
+                best_score = score
+                best = i
+    return masks[best], scores[best]
+
+
+def local_search(mus: np.ndarray, sigmas: np.ndarray, size: int, time_budget: float):
+    deadline = time.monotonic() + time_budget
+    n = len(mus)
+    mask = np.zeros(n, dtype=bool)
+    sum1 = sum2 = 0.0
+    count1 = count2 = 0
+    for i in np.argsort(-mus, kind="stable"):
+        if count2 == n - size or (count1 < size and sum1 <= sum2):
+            mask[i] = True
+            sum1 += mus[i]
+            count1 += 1
+        else:
+            sum2 += mus[i]
+            count2 += 1
+    diff = sum1 - sum2
+    while time.monotonic() < deadline:
+        team1 = np.flatnonzero(mask)
+        team2 = np.flatnonzero(~mask)
+        # Swapping i from team 1 with j from team 2 changes diff by 2 * (mu_j - mu_i).
+        deltas = 2 * np.subtract.outer(mus[team2], mus[team1]).T
+        candidates = np.abs(diff + deltas)
+        best = np.argmin(candidates)
+        if candidates.flat[best] >= abs(diff) - 1e-9:
+            break
+        i, j = np.unravel_index(best, candidates.shape)
+        mask[team1[i]] = False
+        mask[team2[j]] = True
+        diff += deltas[i, j]
+    mu1 = mus[mask].sum()
+    return mask, quality(mu1, mus.sum() - mu1, (sigmas ** 2).sum(), n)
+
+
+def balance(ids: list, mus, sigmas, exact_max_team_size: int = EXACT_MAX_TEAM_SIZE, time_budget: float = TIME_BUDGET, partial: np.ndarray = None):
+    size = len(ids) // 2
+    mus = np.asarray(mus, dtype=float)
+    sigmas = np.asarray(sigmas, dtype=float)
+    if size <= exact_max_team_size:
+        mask, score = exact(mus, sigmas, size, partial)
+    else:
+        mask, score = local_search(mus, sigmas, size, time_budget)
+    team1 = [x for (x, m) in zip(ids, mask) if m]
+    team2 = [x for (x, m) in zip(ids, mask) if not m]
+    return (team1, team2), float(score)
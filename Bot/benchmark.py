@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import threading
+import time
+import tracemalloc
+import urllib.request
+from aiohttp import web
+
+from api import Api
+from balance import balance
+from game import Game, Result
+from player import Player, env
+from ranking import Ranking, LEADERBOARD_PAGE_SIZE, format_leaderboard
+from replay import Replayer
+from state import update_ratings
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(f):
+        BENCHMARKS[name] = f
+        return f
+    return decorator
+
+
+def start_stub_server(latency: float):
+    game = {"id": 1, "result": 0, "dateTime": "2021-01-01T00:00:00",
+            "players": [{"id": i, "team": 1 + i % 2} for i in range(8)]}
+
+    async def get_game(request):
+        await asyncio.sleep(latency)
+        return web.json_response(game)
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get("/api/games/{id}", get_game)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        return runner, site._server.sockets[0].getsockname()[1]
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    runner, port = asyncio.run_coroutine_threadsafe(serve(), loop).result()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    return stop, f"http://127.0.0.1:{port}/api"
+
+
+async def blocking_command(url: str):
+    with urllib.request.urlopen(f"{url}/games/1") as r:
+        json.loads(r.read())
+
+
+async def async_command(api: Api):
+    await api.get_game_by_id(1)
+
+
+@benchmark("api")
+async def bench_api(args):
+    stop, url = start_stub_server(args.latency)
+    results = {}
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(blocking_command(url) for _ in range(args.commands)))
+        results["blocking"] = args.commands / (time.perf_counter() - start)
+        api = Api(url)
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(async_command(api) for _ in range(args.commands)))
+            results["async"] = args.commands / (time.perf_counter() - start)
+        finally:
+            await api.close()
+    finally:
+        stop()
+    for name, throughput in results.items():
+        print("{}: {:.0f} commands/s".format(name, throughput))
+    return results
+
+
+def reference_balance(queue, ratings):
+    size = len(queue) // 2
+    best_score = 0
+    best_teams = None
+    for team1 in itertools.combinations(queue[1:], size - 1):
+        team1 = queue[:1] + list(team1)
+        team2 = [x for x in queue if x not in team1]
+        score = env.quality([[ratings[x] for x in team1],
+                             [ratings[x] for x in team2]])
+        if score > best_score:
+            best_score = score
+            best_teams = (team1, team2)
+    return best_teams, best_score
+
+
+def random_ratings(rng: random.Random, n: int) -> dict:
+    ratings = {}
+    for i in range(n):
+        if rng.random() < 0.2:
+            ratings[i] = env.create_rating()
+        else:
+            ratings[i] = env.create_rating(
+                rng.gauss(2500, 500), rng.uniform(100, 800))
+    return ratings
+
+
+@benchmark("balance")
+def bench_balance(args):
+    rng = random.Random(args.seed)
+    results = {}
+    for size in range(2, 13):
+        ratings = random_ratings(rng, 2 * size)
+        queue = list(ratings)
+        mus = [ratings[x].mu for x in queue]
+        sigmas = [ratings[x].sigma for x in queue]
+        start = time.perf_counter()
+        teams, score = balance(queue, mus, sigmas)
+        elapsed = time.perf_counter() - start
+        results[size] = {"seconds": elapsed, "quality": score}
+        line = "{}v{}: {:.4f}s quality {:.4f}".format(
+            size, size, elapsed, score)
+        if size <= args.reference_max_team_size:
+            start = time.perf_counter()
+            reference_teams, reference_score = reference_balance(
+                queue, ratings)
+            reference_elapsed = time.perf_counter() - start
+            results[size]["reference_seconds"] = reference_elapsed
+            results[size]["matches_reference"] = teams == reference_teams
+            line += " | reference {:.4f}s quality {:.4f} {}".format(
+                reference_elapsed, reference_score, "match" if teams == reference_teams else "MISMATCH")
+        print(line)
+    return results
+
+
+def generate_games(rng: random.Random, players: int, games: int, team_size: int = 4, results: dict = None) -> list:
+    if results is None:
+        results = {Result.TEAM1: 0.44, Result.TEAM2: 0.44, Result.DRAW: 0.04,
+                   Result.CANCELLED: 0.06, Result.UNDECIDED: 0.02}
+    scores = list(results)
+    weights = list(results.values())
+    history = []
+    for game_id in range(1, games + 1):
+        queue = rng.sample(range(1, players + 1), 2 * team_size)
+        history.append(Game(queue[:team_size], queue[team_size:], game_id,
+                            rng.choices(scores, weights)[0], "2021-01-01T00:00:00"))
+    return history
+
+
+class ReferenceGame:
+    def __init__(self, team1, team2, id=None, score=Result.UNDECIDED, date=None):
+        self.team1 = team1
+        self.team2 = team2
+        self.id = id
+        self.score = score
+        self.date = date
+
+    @staticmethod
+    def from_dict(d):
+        players = d["players"]
+        team1 = list(map(lambda x: x["id"], filter(
+            lambda x: x["team"] == 1, players)))
+        team2 = list(map(lambda x: x["id"], filter(
+            lambda x: x["team"] == 2, players)))
+        return ReferenceGame(team1, team2, d.get("id"), Result(d["result"]), d.get("dateTime"))
+
+
+class ReferencePlayer:
+    def __init__(self, rating):
+        self.rating = rating
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        self.history = []
+
+    @staticmethod
+    def from_dict(d):
+        player = ReferencePlayer(env.create_rating(d["mu"], d["sigma"]))
+        player.wins = d["wins"]
+        player.losses = d["losses"]
+        player.draws = d["draws"]
+        player.history = list(zip(d["game_ids"], d["ratings"]))
+        return player
+
+
+def traced_size(f, *args) -> tuple:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = f(*args)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+@benchmark("memory")
+def bench_memory(args):
+    rng = random.Random(args.seed)
+    dicts = json.loads(json.dumps([x.to_dict() for x in generate_games(
+        rng, args.players, args.games, args.team_size)]))
+    games, game_bytes = traced_size(lambda: list(map(Game.from_dict, dicts)))
+    _, reference_game_bytes = traced_size(
+        lambda: list(map(ReferenceGame.from_dict, dicts)))
+    players = {}
+    for game in games:
+        update_ratings(players, game)
+    dicts = json.loads(json.dumps([x.to_dict() for x in players.values()]))
+    _, player_bytes = traced_size(lambda: list(map(Player.from_dict, dicts)))
+    _, reference_player_bytes = traced_size(
+        lambda: list(map(ReferencePlayer.from_dict, dicts)))
+    results = {"bytes_per_game": game_bytes / len(games),
+               "reference_bytes_per_game": reference_game_bytes / len(games),
+               "bytes_per_player": player_bytes / len(players),
+               "reference_bytes_per_player": reference_player_bytes / len(players)}
+    print("{} games: {:.0f} bytes per game, reference {:.0f}".format(
+        len(games), results["bytes_per_game"], results["reference_bytes_per_game"]))
+    print("{} players: {:.0f} bytes per player, reference {:.0f}".format(
+        len(players), results["bytes_per_player"], results["reference_bytes_per_player"]))
+    return results
+
+
+def reference_update_ratings(players: dict, game: Game) -> None:
+    if game.score == Result.TEAM1:
+        ranks = [0, 1]
+    elif game.score == Result.TEAM2:
+        ranks = [1, 0]
+    elif game.score == Result.DRAW:
+        ranks = [0, 0]
+    else:
+        return
+    for player_id in game.team1 + game.team2:
+        if player_id not in players:
+            players[player_id] = Player()
+    team1_ratings, team2_ratings = env.rate(
+        [[players[x].rating for x in game.team1],
+         [players[x].rating for x in game.team2]], ranks=ranks)
+    for (player_id, rating) in zip(game.team1 + game.team2, team1_ratings + team2_ratings):
+        players[player_id].rating = rating
+
+
+@benchmark("replay")
+def bench_replay(args):
+    rng = random.Random(args.seed)
+    games = generate_games(rng, args.players, args.games, args.team_size,
+                           parse_results(args.results))
+    start = time.perf_counter()
+    players = replay(games)
+    elapsed = time.perf_counter() - start
+    reference = {}
+    start = time.perf_counter()
+    for game in games:
+        reference_update_ratings(reference, game)
+    reference_elapsed = time.perf_counter() - start
+    deviation = max(max(abs(players[x].rating.mu - reference[x].rating.mu),
+                        abs(players[x].rating.sigma - reference[x].rating.sigma)) for x in reference)
+    print("{} games: {:.2f}s, env.rate {:.2f}s ({:.0f}x), max deviation {:.2e}".format(
+        len(games), elapsed, reference_elapsed, reference_elapsed / elapsed, deviation))
+    return {"seconds": elapsed, "reference_seconds": reference_elapsed, "max_deviation": deviation}
+
+
+def timed(f, *args) -> float:
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def replay(games: list) -> dict:
+    replayer = Replayer()
+    for game in games:
+        replayer.rate(game)
+    return replayer.finish()
+
+
+def lookup_rating_changes(players: dict, calls: int, rng: random.Random) -> None:
+    players = [x for x in players.values() if x.game_ids]
+    for _ in range(calls):
+        player = rng.choice(players)
+        player.rating_change(rng.choice(player.game_ids))
+
+
+def render_leaderboard(players: dict) -> None:
+    ranking = Ranking.from_players(players)
+    entries = [(f"<@{x}>", players[x]) for x in ranking]
+    for start in range(0, len(entries), LEADERBOARD_PAGE_SIZE):
+        format_leaderboard(entries[start:start+LEADERBOARD_PAGE_SIZE], start + 1)
+
+
+def parse_results(value: str) -> dict:
+    weights = list(map(float, value.split(",")))
+    return dict(zip([Result.TEAM1, Result.TEAM2, Result.DRAW, Result.CANCELLED, Result.UNDECIDED], weights))
+
+
+@benchmark("suite")
+def bench_suite(args):
+    rng = random.Random(args.seed)
+    results = {
+        "time": time.time(),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "players": args.players,
+        "team_size": args.team_size,
+        "results": args.results,
+        "scenarios": {},
+    }
+    for size in args.sizes:
+        games = generate_games(rng, args.players, size, args.team_size,
+                               parse_results(args.results))
+        dicts = json.loads(json.dumps([x.to_dict() for x in games]))
+        scenario = {}
+        scenario["from_dict"] = timed(lambda: list(map(Game.from_dict, dicts)))
+        start = time.perf_counter()
+        players = replay(games)
+        scenario["replay"] = time.perf_counter() - start
+        scenario["rating_change_10k"] = timed(
+            lookup_rating_changes, players, 10000, rng)
+        scenario["leaderboard"] = timed(render_leaderboard, players)
+        results["scenarios"][size] = scenario
+        print("{} games: {}".format(size, ", ".join(
+            "{} {:.4f}s".format(k, v) for (k, v) in scenario.items())))
+    ratings = random_ratings(rng, 2 * max(args.balance_sizes))
+    results["balance"] = {}
+    for size in args.balance_sizes:
+        queue = list(ratings)[:2 * size]
+        mus = [ratings[x].mu for x in queue]
+        sigmas = [ratings[x].sigma for x in queue]
+        balance(queue, mus, sigmas)
+        results["balance"][size] = timed(balance, queue, mus, sigmas)
+        print("balance {}v{}: {:.4f}s".format(
+            size, size, results["balance"][size]))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--team-size", type=int, default=4)
+    parser.add_argument("--reference-max-team-size", type=int, default=8)
+    parser.add_argument("--results", default="0.44,0.44,0.04,0.06,0.02",
+                        help="weights of team 1 wins, team 2 wins, draws, cancelled and undecided games")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--balance-sizes", type=int, nargs="+",
+                        default=[4, 6, 8, 10, 12, 16])
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+    result = BENCHMARKS[args.benchmark](args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+
+if __name__ == "__main__":
+    main()
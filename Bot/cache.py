@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional, List
+from api import Api
+from game import Game
+
+
+class CachedApi:
+    def __init__(self, api: Api, size: int = 256, ttl: float = 300):
+        self.api = api
+        self.size = size
+        self.ttl = ttl
+        self.games = OrderedDict()
+        self.last_game_id = None
+        self.last_game_id_time = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def close(self) -> None:
+        await self.api.close()
+
+    def _get(self, game_id: int) -> Optional[Game]:
+        entry = self.games.get(game_id)
+        if entry is None:
+            return None
+        game, expires = entry
+        if expires < time.monotonic():
+            del self.games[game_id]
+            return None
+        self.games.move_to_end(game_id)
+        return game.copy()
+
+    def _put(self, game: Game) -> None:
+        self.games[game.id] = (game.copy(), time.monotonic() + self.ttl)
+        self.games.move_to_end(game.id)
+        while len(self.games) > self.size:
+            self.games.popitem(last=False)
+
+    def _set_last_game_id(self, game_id: int) -> None:
+        if self.last_game_id is None or game_id >= self.last_game_id:
+            self.last_game_id = game_id
+            self.last_game_id_time = time.monotonic()
+
+    def _last_game_id_valid(self) -> bool:
+        return self.last_game_id is not None and time.monotonic() - self.last_game_id_time < self.ttl
+
+    def iter_games(self, player_id: int = None, after_id: int = None, limit: int = None, newest_first: bool = False) -> AsyncIterator[Game]:
+        return self.api.iter_games(player_id, after_id, limit, newest_first)
+
+    async def get_games(self, player_id: int = None, after_id: int = None, limit: int = None, newest_first: bool = False) -> List[Game]:
+        games = await self.api.get_games(player_id, after_id, limit, newest_first)
+        if games and player_id is None and (newest_first or limit is None):
+            self._set_last_game_id(max(x.id for x in games))
+        return games
+
+    async def get_game_by_id(self, game_id: int) -> Optional[Game]:
+        game = self._get(game_id)
+        if game is not None:
+            self.hits += 1
+            return game
+        self.misses += 1
+        game = await self.api.get_game_by_id(game_id)
+        if game is not None:
+            self._put(game)
+        return game
+
+    async def get_last_game_id(self) -> Optional[int]:
+        if self._last_game_id_valid():
+            self.hits += 1
+            return self.last_game_id
+        game = await self.get_last_game()
+        if game is None:
+            return None
+        return game.id
+
+    async def get_last_game(self) -> Optional[Game]:
+        if self._last_game_id_valid():
+            game = self._get(self.last_game_id)
+            if game is not None:
+                self.hits += 1
+                return game
+        self.misses += 1
+        game = await self.api.get_last_game()
+        if game is not None:
+            self._put(game)
+            self._set_last_game_id(game.id)
+        return game
+
+    async def create_game(self, game: Game) -> Game:
+        game = await self.api.create_game(game)
+        self._put(game)
+        self._set_last_game_id(game.id)
+        return game
+
+    async def update_game(self, game: Game) -> Game:
+        game = await self.api.update_game(game)
+        self._put(game)
+        return game
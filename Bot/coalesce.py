@@ -0,0 +1,33 @@
+import asyncio
+import traceback
+
+
+class Coalescer:
+    def __init__(self, callback, delay: float = 0):
+        self.callback = callback
+        self.delay = delay
+        self.pending = False
+        self.task = None
+        self.error = None
+
+    def trigger(self) -> None:
+        self.pending = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+
+    async def wait(self) -> None:
+        if self.task is not None:
+            await asyncio.shield(self.task)
+        if self.error is not None:
+            raise self.error
+
+    async def _run(self) -> None:
+        while self.pending:
+            await asyncio.sleep(self.delay)
+            self.pending = False
+            try:
+                await self.callback()
+                self.error = None
+            except Exception as e:
+                traceback.print_exc()
+                self.error = e
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import zlib
+import toml
+from typing import AsyncIterator
+from api import Api
+from player import DEFAULT_RATING, Rating
+from replay import rate_teams
+
+FORMATS = ["csv", "jsonl"]
+CSV_FIELDS = ["game_id", "date", "result", "team", "player_id",
+              "mu_before", "sigma_before", "rating_before",
+              "mu_after", "sigma_after", "rating_after"]
+CHUNK_SIZE = 1 << 16
+
+
+def iter_records(ratings: dict, games: list):
+    for game in games:
+        before1 = [ratings.get(x, DEFAULT_RATING) for x in game.team1]
+        before2 = [ratings.get(x, DEFAULT_RATING) for x in game.team2]
+        after1, after2 = before1, before2
+        if game.score.is_rated():
+            mus1, sigmas1, mus2, sigmas2 = rate_teams(
+                [x.mu for x in before1], [x.sigma for x in before1],
+                [x.mu for x in before2], [x.sigma for x in before2], game.score)
+            after1 = list(map(Rating, mus1, sigmas1))
+            after2 = list(map(Rating, mus2, sigmas2))
+            ratings.update(zip(game.team1, after1))
+            ratings.update(zip(game.team2, after2))
+        players = [(1, x, before, after) for (x, before, after)
+                   in zip(game.team1, before1, after1)]
+        players += [(2, x, before, after) for (x, before, after)
+                    in zip(game.team2, before2, after2)]
+        yield game, players
+
+
+def write_csv(writer, game, players) -> None:
+    for (team, player_id, before, after) in players:
+        writer.writerow([game.id, game.date, game.score.name.lower(), team, player_id,
+                         before.mu, before.sigma, before.mu - 2 * before.sigma,
+                         after.mu, after.sigma, after.mu - 2 * after.sigma])
+
+
+def write_jsonl(buffer, game, players) -> None:
+    record = {
+        "id": game.id,
+        "date": game.date,
+        "result": game.score.name.lower(),
+        "players": [{"id": player_id, "team": team,
+                     "mu_before": before.mu, "sigma_before": before.sigma,
+                     "rating_before": before.mu - 2 * before.sigma,
+                     "mu_after": after.mu, "sigma_after": after.sigma,
+                     "rating_after": after.mu - 2 * after.sigma}
+                    for (team, player_id, before, after) in players],
+    }
+    buffer.write(json.dumps(record) + "\n")
+
+
+class Exporter:
+    def __init__(self, f, format: str = "csv"):
+        self.f = f
+        self.format = format
+        self.ratings = {}
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        if format == "csv":
+            self.writer.writerow(CSV_FIELDS)
+
+    def feed(self, games: list) -> None:
+        for (game, players) in iter_records(self.ratings, games):
+            if self.format == "csv":
+                write_csv(self.writer, game, players)
+            else:
+                write_jsonl(self.buffer, game, players)
+            if self.buffer.tell() >= CHUNK_SIZE:
+                self.f.write(self.compressor.compress(
+                    self.buffer.getvalue().encode()))
+                self.buffer.seek(0)
+                self.buffer.truncate()
+
+    def finish(self) -> None:
+        self.f.write(self.compressor.compress(
+            self.buffer.getvalue().encode()) + self.compressor.flush())
+
+
+async def export(games: AsyncIterator, f, format: str = "csv", batch_size: int = 1000) -> None:
+    # Replaying, formatting and compressing run in the default executor one
+    # batch at a time, so the event loop only fetches pages.
+    loop = asyncio.get_running_loop()
+    exporter = Exporter(f, format)
+    batch = []
+    async for game in games:
+        batch.append(game)
+        if len(batch) >= batch_size:
+            await loop.run_in_executor(None, exporter.feed, batch)
+            batch = []
+    await loop.run_in_executor(None, exporter.feed, batch)
+    await loop.run_in_executor(None, exporter.finish)
+
+
+async def export_to_path(url: str, path: str, format: str) -> None:
+    api = Api(url)
+    try:
+        with open(path, "wb") as f:
+            await export(api.iter_games(), f, format)
+    finally:
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="config.toml")
+    parser.add_argument("--api", help="defaults to the api of the config file")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--output", help="defaults to games.<format>.gz")
+    args = parser.parse_args()
+    url = args.api or toml.load(args.config)["api"]
+    output = args.output or f"games.{args.format}.gz"
+    asyncio.run(export_to_path(url, output, args.format))
+
+
+if __name__ == "__main__":
+    main()
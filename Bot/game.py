@@ -8,8 +8,13 @@ class Result(Enum):
     DRAW = 3
     CANCELLED = 4
 
+    def is_rated(self) -> bool:
+        return self in (Result.TEAM1, Result.TEAM2, Result.DRAW)
+
 
 class Game:
+    __slots__ = ("team1", "team2", "id", "score", "date")
+
     def __init__(self, team1, team2, id=None, score=Result.UNDECIDED, date=None):
         self.team1 = team1
         self.team2 = team2
@@ -17,6 +22,9 @@ class Game:
         self.score = score
         self.date = date
 
+    def copy(self):
+        return Game(list(self.team1), list(self.team2), self.id, self.score, self.date)
+
     def to_dict(self) -> dict:
         players = []
         for player in self.team1:
@@ -0,0 +1,78 @@
+from balance import balance, partial_sums, EXACT_MAX_TEAM_SIZE
+
+
+class Lobby:
+    def __init__(self, team_size: int = 4, balance_options: dict = None):
+        self.queue = set()
+        self.team_size = team_size
+        self.balance_options = balance_options or {}
+        self.frozen = False
+        self.game_id = None
+        self.pending = 0
+        self.ratings = {}
+        self.projection = None
+        self.partial = None
+
+    def add(self, player_id: int, rating) -> None:
+        if player_id in self.queue:
+            raise KeyError
+        self.queue.add(player_id)
+        self.ratings[player_id] = rating
+        self.changed()
+
+    def remove(self, player_id: int) -> None:
+        self.queue.remove(player_id)
+        del self.ratings[player_id]
+        self.changed()
+
+    def clear(self) -> None:
+        self.queue = set()
+        self.ratings = {}
+        self.changed()
+
+    def set_ratings(self, ratings: dict) -> None:
+        updated = False
+        for (player_id, rating) in ratings.items():
+            if player_id in self.queue and self.ratings[player_id] != rating:
+                self.ratings[player_id] = rating
+                updated = True
+        if updated:
+            self.partial = None
+            self.changed()
+
+    def changed(self) -> None:
+        self.projection = None
+        # One player short of a full queue, the team sums of the known players
+        # are prepared so the last join only has to add its own rating.
+        if len(self.queue) == 2 * self.team_size - 1 and self.team_size <= self.balance_options.get("exact_max_team_size", EXACT_MAX_TEAM_SIZE):
+            order = list(self.queue)
+            self.partial = (order, partial_sums(
+                [self.ratings[x].mu for x in order], self.team_size))
+        elif len(self.queue) != 2 * self.team_size:
+            self.partial = None
+
+    def project(self):
+        if len(self.queue) < 2 or len(self.queue) % 2:
+            return None
+        if self.projection is None:
+            queue = list(self.queue)
+            partial = None
+            if self.partial is not None and len(self.queue) == 2 * self.team_size:
+                order, sums = self.partial
+                new = self.queue.difference(order)
+                if len(new) == 1:
+                    queue = order + list(new)
+                    partial = sums
+            self.projection = balance(queue,
+                                      [self.ratings[x].mu for x in queue],
+                                      [self.ratings[x].sigma for x in queue],
+                                      partial=partial, **self.balance_options)
+        return self.projection
+
+    def is_full(self) -> bool:
+        return len(self.queue) == 2 * self.team_size
+
+    def pop(self) -> list:
+        queue = list(self.queue)
+        self.clear()
+        return queue
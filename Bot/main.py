@@ -1,23 +1,42 @@
+import time
+started = time.perf_counter()
+
+import asyncio
+import datetime
 import discord
-import itertools
+import functools
+import io
 import math
 import os
-import requests
-import time
+import tempfile
 import toml
-import trueskill
+from typing import Optional
 from discord.ext import commands
 from dotenv import load_dotenv
-import matplotlib.pyplot as plt
 
 from state import State
-from api import Api
+from lobby import Lobby
+from coalesce import Coalescer
+from ranking import LEADERBOARD_PAGE_SIZE, format_leaderboard
+from plot import HistoryPlotter
+from notify import Dispatcher
+from outbox import OutboxRejected
+from ranksync import RankSync
+from export import FORMATS, export
+from metrics import metrics, Watchdog
+from balance import balance as balance_teams
 from game import Game, Result
-from player import Player, env
+from player import Player
+
+load_dotenv()
+config = toml.load("config.toml")
+state = State(config)
 
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix='?', intents=intents)
+bot_class = commands.AutoShardedBot if config.get(
+    "sharded", False) else commands.Bot
+bot = bot_class(command_prefix='?', intents=intents)
 
 
 async def check_organiser(ctx):
@@ -57,70 +76,232 @@ def is_ranked(user: discord.Member):
     return len(set(map(lambda x: x.id, user.roles)).intersection(state.roles["ranked"])) > 0
 
 
+startup = {}
+ready = None
+
+
+def startup_phase(name: str):
+    if name in startup:
+        return
+    startup[name] = time.perf_counter() - started
+    metrics.observe(f"startup.{name}", startup[name])
+    if "ratings" in startup and "gateway" in startup:
+        print("Startup: {} (since process start)".format(", ".join(
+            "{} {:.2f}s".format(k, v) for (k, v) in startup.items())))
+
+
+@bot.before_invoke
+async def before_invoke(ctx):
+    ctx.invoke_start = time.perf_counter()
+    await ready.wait()
+
+
+@bot.after_invoke
+async def after_invoke(ctx):
+    metrics.observe(f"command.{ctx.command.qualified_name}",
+                    time.perf_counter() - ctx.invoke_start)
+
+
+def ranked_members(guild: discord.Guild):
+    for role_id in state.roles["ranked"]:
+        role = guild.get_role(role_id)
+        if role is not None:
+            yield from (x.id for x in role.members)
+
+
 @bot.event
 async def on_ready():
-    await update_leaderboard()
+    startup_phase("gateway")
+    for guild in bot.guilds:
+        state.set_members((guild.id, True), ranked_members(guild))
+        state.set_members((guild.id, False), (x.id for x in guild.members))
+    leaderboard_refresh.trigger()
+    rank_refresh.trigger()
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.roles == after.roles:
+        return
+    if state.set_member((after.guild.id, True), after.id, is_ranked(after)) and after.id in state.players:
+        leaderboard_refresh.trigger()
+
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    state.set_member((member.guild.id, False), member.id, True)
+    if state.set_member((member.guild.id, True), member.id, is_ranked(member)) and member.id in state.players:
+        leaderboard_refresh.trigger()
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    state.set_member((member.guild.id, False), member.id, False)
+    if state.set_member((member.guild.id, True), member.id, False) and member.id in state.players:
+        leaderboard_refresh.trigger()
+
+
+def leaderboard_embed(ranking, page: int) -> discord.Embed:
+    pages = math.ceil(len(ranking) / LEADERBOARD_PAGE_SIZE)
+    start = LEADERBOARD_PAGE_SIZE * (page - 1)
+    entries = [(f"<@{x}>", state.players[x])
+               for x in ranking.page(page - 1, LEADERBOARD_PAGE_SIZE)]
+    return discord.Embed(title=f"Leaderboard ({page}/{pages})",
+                         description=format_leaderboard(entries, start + 1))
+
+
+def embed_content(embed: discord.Embed) -> tuple:
+    return embed.title, embed.description
+
+
+async def get_leaderboard_messages(channel) -> list:
+    if channel.id not in state.leaderboard:
+        messages = []
+        async for message in channel.history(limit=100, oldest_first=True):
+            if message.author == bot.user and message.embeds and (message.embeds[0].title or "").startswith("Leaderboard"):
+                messages.append((message, embed_content(message.embeds[0])))
+        state.leaderboard[channel.id] = messages
+    return state.leaderboard[channel.id]
 
 
 async def update_leaderboard():
-    for message in state.leaderboard:
-        try:
-            await message.delete()
-        except discord.errors.NotFound:
-            pass
-    messages = []
-    for channel_id in state.channels["leaderboard"]:
-        channel = bot.get_channel(channel_id)
-        players = list(
-            filter(lambda x: x[0] and is_ranked(x[0]), map(lambda x: (channel.guild.get_member(x), state.get_player(x) or Player()), state.players.keys())))
-        players = sorted(players, key=lambda x: -x[1].conservative_rating())
-        pages = math.ceil(len(players) / 20)
-        for page in range(pages):
-            start = 20 * page
-            description = ""
-            for (i, player) in enumerate(players[start:start+20], start + 1):
-                name = player[0].mention
-                conservative_rating = player[1].conservative_rating()
-                mu = player[1].rating.mu
-                sigma = 2 * player[1].rating.sigma
-                description += "{}: {} - **{:.0f}** ({:.0f} ± {:.0f})\n".format(
-                    i, name, conservative_rating, mu, sigma)
-            embed = discord.Embed(
-                title=f"Leaderboard ({page + 1}/{pages})", description=description)
-            message = await channel.send(embed=embed)
-            print(message)
-            messages.append(message)
-    state.leaderboard = messages
+    await ready.wait()
+    await asyncio.gather(*(update_leaderboard_channel(x)
+                           for x in state.channels["leaderboard"]))
+
+
+async def update_leaderboard_channel(channel_id: int):
+    channel = bot.get_channel(channel_id)
+    if channel is None:
+        return
+    ranking = state.get_ranking(channel.guild.id)
+    pages = math.ceil(len(ranking) / LEADERBOARD_PAGE_SIZE)
+    embeds = [leaderboard_embed(ranking, page)
+              for page in range(1, pages + 1)]
+    posted = await get_leaderboard_messages(channel)
+    keep = min(len(posted), len(embeds))
+    edits = [(i, channel.id, functools.partial(posted[i][0].edit, embed=embeds[i]))
+             for i in range(keep) if posted[i][1] != embed_content(embeds[i])]
+    failed = await dispatcher.dispatch(edits)
+    if failed:
+        keep = min(i for (i, _) in failed)
+    messages = [(posted[i][0], embed_content(embeds[i])) for i in range(keep)]
+    await dispatcher.dispatch([(i, channel.id, posted[i][0].delete)
+                               for i in range(keep, len(posted))])
+    for embed in embeds[keep:]:
+        message = await channel.send(embed=embed)
+        messages.append((message, embed_content(embed)))
+    state.leaderboard[channel_id] = messages
+
+
+leaderboard_refresh = Coalescer(
+    update_leaderboard, config.get("leaderboard_delay", 2))
+plotter = HistoryPlotter(config.get("plot_cache_size", 64))
+dispatcher = Dispatcher(config.get("notify_concurrency", 5))
+rank_sync = RankSync(bot, state, dispatcher,
+                     config.get("rank_sync_chunk_size", 100),
+                     config.get("rank_sync_chunk_delay", 1))
+
+
+async def sync_ranks():
+    await ready.wait()
+    await rank_sync.run()
+
+
+rank_refresh = Coalescer(sync_ranks, config.get("rank_sync_delay", 2))
 
 
 def balance(queue, estimates=None):
-    size = len(queue) // 2
-    best_score = 0
-    best_teams = None
-    for team1 in itertools.combinations(queue[1:], size - 1):
-        team1 = queue[:1] + list(team1)
-        team2 = [x for x in queue if x not in team1]
-        def get_player(x): return state.get_player(x) or Player()
-        if estimates is None:
-            def get_rating(x): return get_player(x).rating
-        else:
-            def get_rating(x): return trueskill.Rating(
-                mu=estimates[x], sigma=get_player(x).sigma) if x in estimates else get_player(x).rating
-
-        team1_rating = list(map(get_rating, team1))
-        team2_rating = list(map(get_rating, team2))
-        score = env.quality([team1_rating, team2_rating])
-        if score > best_score:
-            best_score = score
-            best_teams = (team1, team2)
-    return best_teams, best_score
-
-
-async def start_game(ctx):
-    queue = list(state.queue)
-    state.queue = set()
-    (team1, team2), quality = balance(queue)
-    state.api.create_game(Game(team1, team2))
+    if estimates is None:
+        estimates = {}
+    ratings = [(state.get_player(x) or Player()).rating for x in queue]
+    mus = [estimates.get(x, rating.mu) for (x, rating) in zip(queue, ratings)]
+    sigmas = [rating.sigma for rating in ratings]
+    return balance_teams(queue, mus, sigmas, **state.balance_options)
+
+
+def get_lobby(ctx) -> Lobby:
+    return state.get_lobby(ctx.guild.id, ctx.channel.id)
+
+
+async def get_lobby_game(ctx) -> Optional[Game]:
+    lobby = get_lobby(ctx)
+    if lobby.pending:
+        await ctx.send("The last game of this lobby is still waiting to be recorded. Try again when it is.")
+        return None
+    if lobby.game_id is not None:
+        return await state.api.get_game_by_id(lobby.game_id)
+    return await state.api.get_last_game()
+
+
+async def save_game(ctx, game: Game, previous_score: Result) -> Optional[Game]:
+    try:
+        game = await state.outbox.update_game(game, {
+            "channel": ctx.channel.id, "previous_score": previous_score.value})
+    except OutboxRejected as e:
+        await ctx.send(f"The API rejected the change ({e}). It was not saved.")
+        return None
+    if not game:
+        await ctx.send(
+            "The API is unreachable. The change will be saved when it is back.")
+    return game
+
+
+async def apply_game_update(channel, game: Game, previous_score: Result) -> bool:
+    try:
+        await state.game_updated(game, previous_score)
+    except Exception as e:
+        if channel:
+            await channel.send("Game #{} was saved but the ratings could not be rebuilt ({!r}). They will be rebuilt on the next change.".format(game.id, e))
+        return False
+    return True
+
+
+async def on_outbox_applied(op: str, game: Game, meta: dict):
+    channel = bot.get_channel(meta.get("channel"))
+    if op == "create":
+        state.game_created(game)
+        if meta.get("guild"):
+            lobby = state.get_lobby(meta["guild"], meta["channel"])
+            lobby.game_id = game.id
+            lobby.pending = max(0, lobby.pending - 1)
+        message = "Game #{} has been recorded.".format(game.id)
+    else:
+        previous_score = Result(meta["previous_score"])
+        if not await apply_game_update(channel, game, previous_score):
+            return
+        if game.score.is_rated() or previous_score.is_rated():
+            leaderboard_refresh.trigger()
+            rank_refresh.trigger()
+        message = "Game #{} has been saved.".format(game.id)
+    if channel:
+        await channel.send(message)
+
+
+async def on_outbox_rejected(op: str, game: Game, meta: dict, error: str):
+    channel = bot.get_channel(meta.get("channel"))
+    if op == "create":
+        if meta.get("guild"):
+            lobby = state.get_lobby(meta["guild"], meta["channel"])
+            lobby.game_id = None
+            lobby.pending = max(0, lobby.pending - 1)
+        message = f"The API rejected a game that was waiting to be recorded ({error}). It was not recorded."
+    else:
+        message = f"The API rejected the change to game #{game.id} ({error}). It was not saved."
+    if channel:
+        await channel.send(message)
+
+
+async def start_game(ctx, lobby: Lobby):
+    (team1, team2), quality = lobby.project()
+    lobby.pop()
+    rejected = None
+    try:
+        game = await state.outbox.create_game(Game(team1, team2), {
+            "guild": ctx.guild.id, "channel": ctx.channel.id})
+    except OutboxRejected as e:
+        game = None
+        rejected = e
     mentions = ""
     description = "Quality: {:.0f}\n".format(100 * quality)
     description += "\nTeam 1:\n"
@@ -135,32 +316,38 @@ async def start_game(ctx):
         name = member.mention
         description += f"{name}\n"
         mentions += "{} ".format(name)
-    id = state.api.get_last_game().id
-    title = "Game #{} started".format(id)
+    if game:
+        state.game_created(game)
+        lobby.game_id = game.id
+        title = "Game #{} started".format(game.id)
+    elif rejected:
+        title = "Game not recorded"
+        description += f"\nThe API rejected the game ({rejected}). It was not recorded.\n"
+    else:
+        lobby.game_id = None
+        lobby.pending += 1
+        title = "Game started"
+        description += "\nThe API is unreachable. The game will be recorded when it is back.\n"
     embed = discord.Embed(title=title, description=description)
     message = await ctx.send(mentions, embed=embed)
+    jobs = []
     if quality < 0.8:
         organiser_role = next(
             x for x in ctx.guild.roles if x.id == state.roles["organiser"][0])
-        await ctx.send("{}, the previous game has a low quality and the teams may be unbalanced. Please check if swaps are needed.".format(organiser_role.mention))
-    for player_id in team1:
-        try:
-            member = ctx.guild.get_member(player_id)
-            await member.send("Game started: {}".format(message.jump_url))
-        except:
-            pass
-    for player_id in team2:
-        try:
-            member = ctx.guild.get_member(player_id)
-            await member.send("Game started: {}".format(message.jump_url))
-        except:
-            pass
+        jobs.append((None, ctx.channel.id, functools.partial(ctx.send, "{}, the previous game has a low quality and the teams may be unbalanced. Please check if swaps are needed.".format(organiser_role.mention))))
+    members = [ctx.guild.get_member(x) for x in team1 + team2]
+    jobs += [(x, x.id, functools.partial(x.send, "Game started: {}".format(message.jump_url)))
+             for x in members if x]
+    failed = [x for (x, _) in await dispatcher.dispatch(jobs) if x is not None]
+    if failed:
+        await ctx.send("Could not notify {} by DM.".format(
+            ", ".join(x.mention for x in failed)))
 
 
 @bot.command()
 @commands.check(check_organiser_lobby)
 async def rebalance(ctx, *args):
-    game = state.api.get_last_game()
+    game = await get_lobby_game(ctx)
     if not game:
         return
     estimates = {}
@@ -184,7 +371,14 @@ async def rebalance(ctx, *args):
     (team1, team2), quality = balance(game.team1 + game.team2, estimates)
     game.team1 = team1
     game.team2 = team2
-    state.api.update_game(game)
+    game = await save_game(ctx, game, game.score)
+    if not game:
+        return
+    if not await apply_game_update(ctx.channel, game, game.score):
+        return
+    if game.score.is_rated():
+        leaderboard_refresh.trigger()
+        rank_refresh.trigger()
     title = "Game #{}".format(game.id)
     description = "Quality: {:.0f}\n".format(100 * quality)
     description += "\nTeam 1:\n"
@@ -202,24 +396,25 @@ async def rebalance(ctx, *args):
 
 
 async def add_player(ctx, player: discord.User):
+    lobby = get_lobby(ctx)
     name = player.mention
     try:
-        state.add_queue(player.id)
+        lobby.add(player.id, state.get_rating(player.id))
     except KeyError:
         await ctx.send(f"{name} is already in the queue.")
         return
     title = "[{}/{}] {} joined the queue.".format(
-        len(state.queue), 2 * state.team_size, name)
+        len(lobby.queue), 2 * lobby.team_size, name)
     embed = discord.Embed(description=title)
     await ctx.send(embed=embed)
-    if len(state.queue) == 2 * state.team_size:
-        await start_game(ctx)
+    if lobby.is_full():
+        await start_game(ctx, lobby)
 
 
 @bot.command(aliases=['j'])
 @commands.check(check_lobby)
 async def join(ctx):
-    if state.frozen:
+    if get_lobby(ctx).frozen:
         await ctx.send("The queue is frozen.")
         return
     await add_player(ctx, ctx.author)
@@ -232,24 +427,25 @@ async def forcejoin(ctx, user: discord.User):
 
 
 async def remove_player(ctx, player: discord.User):
+    lobby = get_lobby(ctx)
     name = player.mention
     try:
-        state.remove_queue(player.id)
+        lobby.remove(player.id)
     except KeyError:
         await ctx.send(f"{name} is not in the queue.")
         return
     description = "[{}/{}] {} left the queue.".format(
-        len(state.queue), 2 * state.team_size, name)
+        len(lobby.queue), 2 * lobby.team_size, name)
     embed = discord.Embed(description=description)
     await ctx.send(embed=embed)
-    if len(state.queue) == 2 * state.team_size:
-        await start_game(ctx)
+    if lobby.is_full():
+        await start_game(ctx, lobby)
 
 
 @bot.command(aliases=['l'])
 @commands.check(check_lobby)
 async def leave(ctx):
-    if state.frozen:
+    if get_lobby(ctx).frozen:
         await ctx.send("The queue is frozen.")
         return
     await remove_player(ctx, ctx.author)
@@ -267,16 +463,17 @@ async def players(ctx, n: int):
     if n < 1:
         await ctx.send("First argument must be greater than 1.")
         return
-    state.team_size = n
+    lobby = get_lobby(ctx)
+    lobby.team_size = n
     await ctx.send(f"Players per team set to {n}.")
-    if len(state.queue) == 2 * state.team_size:
-        await start_game(ctx)
+    if lobby.is_full():
+        await start_game(ctx, lobby)
 
 
 @bot.command(aliases=['g'])
 @commands.check(check_organiser_lobby)
 async def score(ctx, id: int, team: str):
-    game = state.api.get_game_by_id(id)
+    game = await state.api.get_game_by_id(id)
     if not game:
         await ctx.send("This game does not exist.")
         return
@@ -289,91 +486,90 @@ async def score(ctx, id: int, team: str):
     else:
         await ctx.send("Score must be 1, 2 or draw.")
         return
+    previous_score = game.score
     game.score = result
-    state.api.update_game(game)
-    state.update_players()
-    await update_leaderboard()
+    game = await save_game(ctx, game, previous_score)
+    if not game:
+        return
+    if not await apply_game_update(ctx.channel, game, previous_score):
+        return
+    leaderboard_refresh.trigger()
+    rank_refresh.trigger()
     await _gameinfo(ctx, game)
 
 
 @bot.command(aliases=['cancel'])
 @commands.check(check_organiser_lobby)
 async def cancelgame(ctx, id: int):
-    game = state.api.get_game_by_id(id)
+    game = await state.api.get_game_by_id(id)
     if not game:
         await ctx.send("This game does not exist.")
         return
+    previous_score = game.score
     game.score = Result.CANCELLED
-    state.api.update_game(game)
-    state.update_players()
-    await update_leaderboard()
+    if not await save_game(ctx, game, previous_score):
+        return
+    if not await apply_game_update(ctx.channel, game, previous_score):
+        return
+    leaderboard_refresh.trigger()
+    rank_refresh.trigger()
     await ctx.send("Game cancelled.")
 
 
 @bot.command(aliases=['lb'])
 @commands.check(check_organiser_spam)
 async def leaderboard(ctx, page=1):
-    players = list(
-        filter(lambda x: x[0] and is_ranked(x[0]), map(lambda x: (ctx.guild.get_member(x), state.get_player(x) or Player()), state.players.keys())))
-    players = sorted(players, key=lambda x: -x[1].conservative_rating())
-    pages = math.ceil(len(players) / 20)
-    if page > pages:
-        return
-    start = 20 * (page - 1)
-    description = ""
-    for (i, player) in enumerate(players[start:start+20], start + 1):
-        name = player[0].mention
-        conservative_rating = player[1].conservative_rating()
-        mu = player[1].rating.mu
-        sigma = 2 * player[1].rating.sigma
-        description += "{}: {} - **{:.0f}** ({:.0f} ± {:.0f})\n".format(
-            i, name, conservative_rating, mu, sigma)
-    embed = discord.Embed(
-        title=f"Leaderboard ({page}/{pages})", description=description)
-    await ctx.send(embed=embed)
+    await send_leaderboard_page(ctx, state.get_ranking(ctx.guild.id), page)
 
 
 @bot.command()
 @commands.check(check_organiser_spam)
 async def lball(ctx, page=1):
-    players = list(
-        filter(lambda x: x[0], map(lambda x: (ctx.guild.get_member(x), state.get_player(x) or Player()), state.players.keys())))
-    players = sorted(players, key=lambda x: -x[1].conservative_rating())
-    pages = math.ceil(len(players) / 20)
+    await send_leaderboard_page(ctx, state.get_ranking(ctx.guild.id, False), page)
+
+
+async def send_leaderboard_page(ctx, ranking, page: int):
+    pages = math.ceil(len(ranking) / LEADERBOARD_PAGE_SIZE)
     if page > pages:
         return
-    start = 20 * (page - 1)
-    description = ""
-    for (i, player) in enumerate(players[start:start+20], start + 1):
-        name = player[0].mention
-        conservative_rating = player[1].conservative_rating()
-        mu = player[1].rating.mu
-        sigma = 2 * player[1].rating.sigma
-        description += "{}: {} - **{:.0f}** ({:.0f} ± {:.0f})\n".format(
-            i, name, conservative_rating, mu, sigma)
-    embed = discord.Embed(
-        title=f"Leaderboard ({page}/{pages})", description=description)
-    await ctx.send(embed=embed)
+    await ctx.send(embed=leaderboard_embed(ranking, page))
 
 
 @bot.command(aliases=['q'])
 @commands.check(check_lobby)
 async def queue(ctx):
-    last_game = state.api.get_last_game()
-    if last_game:
-        id = last_game.id + 1
+    last_game_id = await state.api.get_last_game_id()
+    if last_game_id:
+        id = last_game_id + 1
     else:
         id = 1
-    title = "Game #{} [{}/{}]".format(id, len(state.queue),
-                                      2 * state.team_size)
+    lobby = get_lobby(ctx)
+    title = "Game #{} [{}/{}]".format(id, len(lobby.queue),
+                                      2 * lobby.team_size)
     description = ""
-    for player_id in state.queue:
+    for player_id in lobby.queue:
         name = ctx.guild.get_member(player_id).mention
         description += "{}\n".format(name)
+    projection = lobby.project()
+    if projection is not None:
+        description += "\nProjected quality: {:.0f}\n".format(
+            100 * projection[1])
     embed = discord.Embed(title=title, description=description)
     await ctx.send(embed=embed)
 
 
+def format_rating_change(player_id: int, game_id: int) -> Optional[str]:
+    player = state.get_player(player_id)
+    if player is None or not player.has_game(game_id):
+        return None
+    rating_change = player.rating_change(game_id)
+    sign = "+"
+    if rating_change < 0:
+        sign = "-"
+        rating_change = -rating_change
+    return "{}{:.0f}".format(sign, rating_change)
+
+
 async def _gameinfo(ctx, game: Game):
     title = f"Game #{game.id}"
     winner = "undecided"
@@ -395,24 +591,12 @@ async def _gameinfo(ctx, game: Game):
             description += "<@{}>\n".format(player_id)
     else:
         for player_id in game.team1:
-            player = state.get_player(player_id)
-            rating_change = player.rating_change(game.id)
-            sign = "+"
-            if rating_change < 0:
-                sign = "-"
-                rating_change = -rating_change
-            description += "<@{}> {}{:.0f}\n".format(
-                player_id, sign, rating_change)
+            description += "<@{}> {}\n".format(
+                player_id, format_rating_change(player_id, game.id) or "?")
         description += "\nTeam 2:\n"
         for player_id in game.team2:
-            player = state.get_player(player_id)
-            rating_change = player.rating_change(game.id)
-            sign = "+"
-            if rating_change < 0:
-                sign = "-"
-                rating_change = -rating_change
-            description += "<@{}> {}{:.0f}\n".format(
-                player_id, sign, rating_change)
+            description += "<@{}> {}\n".format(
+                player_id, format_rating_change(player_id, game.id) or "?")
     embed = discord.Embed(title=title, description=description)
     await ctx.send(embed=embed)
 
@@ -420,7 +604,7 @@ async def _gameinfo(ctx, game: Game):
 @bot.command()
 @commands.check_any(commands.check(check_spam), commands.check(check_lobby))
 async def lastgame(ctx):
-    game = state.api.get_last_game()
+    game = await state.api.get_last_game()
     if not game:
         await ctx.send("No game was played.")
         return
@@ -430,7 +614,7 @@ async def lastgame(ctx):
 @bot.command()
 @commands.check_any(commands.check(check_spam), commands.check(check_lobby))
 async def gameinfo(ctx, id: int):
-    game = state.api.get_game_by_id(id)
+    game = await state.api.get_game_by_id(id)
     if not game:
         await ctx.send("This game does not exist.")
         return
@@ -446,6 +630,10 @@ async def _info(ctx, user: discord.User):
     title = "{}'s stats".format(user.display_name)
     description = "Rating: {:.0f} ({:.0f} ± {:.0f})\n".format(
         conservative_rating, mu, sigma)
+    if ctx.guild is not None:
+        position = state.get_ranking(ctx.guild.id).position(user.id)
+        if position is not None:
+            description += f"Position: #{position + 1}\n"
     rank = state.get_rank(conservative_rating)
     try:
         role_id = rank["id"]
@@ -460,6 +648,12 @@ async def _info(ctx, user: discord.User):
     description += f"Draws: {player.draws}\n"
     description += "Games: {}\n".format(player.wins +
                                         player.losses + player.draws)
+    outcome, length = state.stats.streak(user.id)
+    if outcome is not None:
+        description += f"Streak: {outcome} x{length}\n"
+        form = state.stats.form(user.id)
+        description += "Form: {}\n".format(
+            "".join(x[0].upper() for x in form))
     embed = discord.Embed(title=title, description=description)
     await ctx.send(embed=embed)
 
@@ -491,34 +685,11 @@ async def _history(ctx, user, limit: str):
     if player is None:
         await ctx.send("{} has not played yet.".format(user.mention))
         return
-    ys = list(map(lambda x: x[1], player.history))
-    ys = [Player().conservative_rating()] + ys
-    xs = [i for i in range(len(ys))]
-    if games is not None and len(ys) > games:
-        ys = ys[-games:]
-        xs = xs[-games:]
-    ymin = min(ys)
-    ymax = max(ys)
-    dy = 0.05 * (ymax - ymin)
-    ymin -= dy
-    ymax += dy
-    plt.clf()
-    alpha = 0.3
-    rating_min = 0
-    for rank in state.ranks:
-        rating_max = rank["limit"]
-        plt.axhspan(rating_min, rating_max, alpha=alpha, color=rank["color"])
-        rating_min = rating_max
-    plt.xticks(xs[::round(len(xs)/15)])
-    plt.ylim([ymin, ymax])
-    plt.grid()
-    plt.plot(xs, ys, "black")
-    plt.title(f"{user.display_name}'s rating history")
-    plt.xlabel('game #')
-    plt.ylabel('rating')
-    plt.savefig(fname='plot')
-    await ctx.send(file=discord.File('plot.png'))
-    os.remove('plot.png')
+    title = f"{user.display_name}'s rating history"
+    key = (user.id, player.game_ids[-1], games, state.generation, title)
+    ratings = [Player().conservative_rating()] + player.ratings.tolist()
+    data = await plotter.render(key, ratings, games, state.ranks, title)
+    await ctx.send(file=discord.File(io.BytesIO(data), filename="plot.png"))
 
 
 @bot.command()
@@ -538,38 +709,18 @@ async def forcehistory(ctx, user: discord.User, limit: str = "20"):
 async def gamelist(ctx, user: discord.User = None):
     if user:
         title = "{}'s last games".format(user.display_name)
-        last_games = state.api.get_games(user.id)[-20:][::-1]
         description = ""
-        for game in last_games:
-            result = "undecided"
-            if game.score == Result.TEAM1:
-                if user.id in game.team1:
-                    result = "win"
-                else:
-                    result = "loss"
-            elif game.score == Result.TEAM2:
-                if user.id in game.team2:
-                    result = "win"
-                else:
-                    result = "loss"
-            elif game.score == Result.DRAW:
-                result = "draw"
-            elif game.score == Result.CANCELLED:
-                result = "cancelled"
-            if game.score != Result.UNDECIDED and game.score != Result.CANCELLED:
-                rating_change = state.get_player(
-                    user.id).rating_change(game.id)
-                sign = "+"
-                if rating_change < 0:
-                    sign = "-"
-                    rating_change = -rating_change
-                description += "Game #{}: {} ({}{:.0f})\n".format(game.id,
-                                                                  result, sign, rating_change)
+        for game_id in state.stats.games_of(user.id, 20):
+            result = state.stats.outcome(game_id, user.id)
+            rating_change = format_rating_change(user.id, game_id)
+            if state.stats.games[game_id][0].is_rated() and rating_change:
+                description += "Game #{}: {} ({})\n".format(game_id,
+                                                            result, rating_change)
             else:
-                description += "Game #{}: {}\n".format(game.id, result)
+                description += "Game #{}: {}\n".format(game_id, result)
     else:
         title = "Last games"
-        last_games = state.api.get_games()[-20:][::-1]
+        last_games = await state.api.get_games(limit=20, newest_first=True)
         description = ""
         for game in last_games:
             result = "undecided"
@@ -589,29 +740,42 @@ async def gamelist(ctx, user: discord.User = None):
 @bot.command()
 @commands.check_any(commands.check(check_spam), commands.check(check_lobby), commands.check(check_dm))
 async def stats(ctx):
-    games = state.api.get_games()
-    total_games = len(games)
-    cancelled = 0
-    undecided = 0
-    for game in games:
-        if game.score == Result.CANCELLED:
-            cancelled += 1
-        elif game.score == Result.UNDECIDED:
-            undecided += 1
+    total_games = state.stats.total()
+    cancelled = state.stats.results[Result.CANCELLED]
+    undecided = state.stats.results[Result.UNDECIDED]
+    today = datetime.datetime.utcnow().date()
+    week = "{}-W{:02}".format(*today.isocalendar()[:2])
     title = "Stats"
     description = "Total games: {}\n".format(total_games)
-    description += "Games played: {}\n".format(
-        total_games - cancelled - undecided)
+    description += "Games played: {}\n".format(state.stats.played())
     description += "Cancelled games: {}\n".format(cancelled)
     description += "Undecided games: {}\n".format(undecided)
+    description += "Games today: {}\n".format(
+        state.stats.days[today.isoformat()])
+    description += "Games this week: {}\n".format(state.stats.weeks[week])
     embed = discord.Embed(title=title, description=description)
     await ctx.send(embed=embed)
 
 
+@bot.command()
+@commands.check(check_organiser_spam)
+async def checkstats(ctx):
+    games = await state.api.get_games()
+    errors = state.stats.verify(games, state.players)
+    if not errors:
+        await ctx.send("Stats are consistent with the game history.")
+        return
+    description = "\n".join(errors[:20])
+    if len(errors) > 20:
+        description += "\n... and {} more".format(len(errors) - 20)
+    embed = discord.Embed(title="Stats mismatches", description=description)
+    await ctx.send(embed=embed)
+
+
 @bot.command()
 @commands.check(check_organiser_lobby)
 async def swap(ctx, user1: discord.User, user2: discord.User):
-    game = state.api.get_last_game()
+    game = await get_lobby_game(ctx)
     if not game:
         return
     if user1.id in game.team1:
@@ -635,35 +799,134 @@ async def swap(ctx, user1: discord.User, user2: discord.User):
     else:
         await ctx.send("{} is not playing.".format(user1.mention))
         return
-    state.api.update_game(game)
+    game = await save_game(ctx, game, game.score)
+    if not game:
+        return
     await ctx.send("Players swapped.")
-    if game.score in [Result.TEAM1, Result.TEAM2, Result.DRAW]:
-        state.update_players()
-        await update_leaderboard()
+    if not await apply_game_update(ctx.channel, game, game.score):
+        return
+    if game.score.is_rated():
+        leaderboard_refresh.trigger()
+        rank_refresh.trigger()
+
+
+@bot.command()
+@commands.check(check_organiser_spam)
+async def syncranks(ctx):
+    rank_sync.reconcile()
+    rank_refresh.trigger()
+    await ctx.send("Rank roles will be synchronised.")
+
+
+@bot.command(name="export")
+@commands.check(check_organiser_spam)
+async def export_games(ctx, format: str = "csv"):
+    if format not in FORMATS:
+        await ctx.send("Format should be one of {}.".format(", ".join(FORMATS)))
+        return
+    with tempfile.TemporaryFile() as f:
+        await export(state.api.iter_games(), f, format)
+        if f.tell() > ctx.guild.filesize_limit:
+            await ctx.send("The export is {:.1f} MB, over the upload limit of this server. Run `python3 Bot/export.py --format {}` next to config.toml instead.".format(
+                f.tell() / 2 ** 20, format))
+            return
+        f.seek(0)
+        try:
+            await ctx.send(file=discord.File(f, filename=f"games.{format}.gz"))
+        except discord.HTTPException as e:
+            await ctx.send(f"Could not upload the export: {e.text}")
+
+
+@bot.command()
+@commands.check(check_organiser_spam)
+async def cache(ctx):
+    hits = state.api.hits
+    misses = state.api.misses
+    total = hits + misses
+    description = f"Hits: {hits}\n"
+    description += f"Misses: {misses}\n"
+    if total:
+        description += "Hit rate: {:.0f}%\n".format(100 * hits / total)
+    description += "Cached games: {}/{}\n".format(
+        len(state.api.games), state.api.size)
+    embed = discord.Embed(title="Cache", description=description)
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.check(check_organiser_spam)
+async def perf(ctx):
+    description = metrics.report() or "No data yet."
+    if metrics.blocks:
+        block = metrics.blocks[-1]
+        description += "\n\nEvent loop blocks: {} (last: {:.0f}ms)".format(
+            len(metrics.blocks), 1000 * block["seconds"])
+    embed = discord.Embed(title="Performance", description=description[:4000])
+    await ctx.send(embed=embed)
+
+
+async def dump_metrics(path: str, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            metrics.dump(path)
+        except OSError as e:
+            print(f"Could not write metrics: {e!r}")
 
 
 @bot.command(aliases=['clear', 'clearq'])
 @commands.check(check_organiser_lobby)
 async def clearqueue(ctx):
-    state.queue = set()
+    get_lobby(ctx).clear()
     await ctx.send("Queue cleared.")
 
 
 @bot.command()
 @commands.check(check_organiser_lobby)
 async def freeze(ctx):
-    state.frozen = True
+    get_lobby(ctx).frozen = True
     await ctx.send("Queue frozen.")
 
 
 @bot.command()
 @commands.check(check_organiser_lobby)
 async def unfreeze(ctx):
-    state.frozen = False
+    get_lobby(ctx).frozen = False
     await ctx.send("Queue unfrozen.")
 
-load_dotenv()
-config = toml.load("config.toml")
-state = State(config)
-state.update_players()
-bot.run(os.getenv('DISCORD_TOKEN'))
+
+async def load_state():
+    try:
+        await state.load()
+    except:
+        await bot.close()
+        raise
+    startup_phase("ratings")
+    state.outbox.on_applied = on_outbox_applied
+    state.outbox.on_rejected = on_outbox_rejected
+    for entry in state.outbox.entries:
+        if entry["op"] == "create" and entry["meta"].get("guild"):
+            state.get_lobby(entry["meta"]["guild"],
+                            entry["meta"]["channel"]).pending += 1
+    state.outbox.start()
+    ready.set()
+
+
+async def main():
+    global ready
+    ready = asyncio.Event()
+    startup_phase("imports")
+    metrics_config = config.get("metrics", {})
+    Watchdog(metrics, metrics_config.get("block_threshold", 0.25)).start()
+    asyncio.ensure_future(dump_metrics(metrics_config.get(
+        "file", "metrics.json"), metrics_config.get("interval", 60)))
+    loading = asyncio.ensure_future(load_state())
+    try:
+        await bot.start(os.getenv('DISCORD_TOKEN'))
+        await loading
+    finally:
+        loading.cancel()
+        await state.journal_writer.wait()
+        await state.api.close()
+
+asyncio.run(main())
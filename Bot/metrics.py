@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_BLOCKS = 20
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        target = q * self.count
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+            "buckets": dict(zip(list(map(str, BUCKETS)) + ["+Inf"], self.counts)),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self.blocks = []
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name: str):
+        def decorator(f):
+            @functools.wraps(f)
+            async def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return await f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def block(self, seconds: float, stack: str) -> None:
+        self.observe("loop.blocked", seconds)
+        self.blocks.append({"time": time.time(), "seconds": seconds,
+                            "stack": stack})
+        del self.blocks[:-MAX_BLOCKS]
+
+    def to_dict(self) -> dict:
+        return {
+            "time": time.time(),
+            "histograms": {k: v.to_dict() for (k, v) in sorted(self.histograms.items())},
+            "blocks": self.blocks,
+        }
+
+    def report(self, prefix: str = "") -> str:
+        lines = []
+        for (name, histogram) in sorted(self.histograms.items()):
+            if not name.startswith(prefix):
+                continue
+            lines.append("{}: n={} p50={:.0f}ms p95={:.0f}ms max={:.0f}ms".format(
+                name, histogram.count, 1000 * histogram.quantile(0.5),
+                1000 * histogram.quantile(0.95), 1000 * histogram.max))
+        return "\n".join(lines)
+
+    def dump(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+
+
+class Watchdog:
+    def __init__(self, metrics: Metrics, threshold: float = 0.25, interval: float = 0.05):
+        self.metrics = metrics
+        self.threshold = threshold
+        self.interval = interval
+        self.heartbeat = time.monotonic()
+        self.loop_thread = None
+
+    def start(self) -> None:
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        asyncio.ensure_future(self._beat())
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    async def _beat(self) -> None:
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        reported = None
+        while True:
+            time.sleep(self.interval)
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat
+            if blocked > self.threshold and reported != heartbeat:
+                reported = heartbeat
+                frame = sys._current_frames().get(self.loop_thread)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                print("Event loop blocked for {:.0f}ms:\n{}".format(
+                    1000 * blocked, stack))
+                self.metrics.block(blocked, stack)
+
+
+metrics = Metrics()
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+
+class Dispatcher:
+    def __init__(self, concurrency: int = 5, rate: float = 40, per_bucket: int = 1):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.per_bucket = per_bucket
+        self.buckets = {}
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def _take_token(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def _run(self, bucket, f) -> None:
+        # discord.py already waits out 429 responses, the token bucket only
+        # keeps bursts from reaching them.
+        if bucket not in self.buckets:
+            self.buckets[bucket] = [asyncio.Semaphore(self.per_bucket), 0]
+        entry = self.buckets[bucket]
+        entry[1] += 1
+        try:
+            async with entry[0], self.semaphore:
+                await self._take_token()
+                await f()
+        finally:
+            # Buckets are member or channel ids, drop them once idle.
+            entry[1] -= 1
+            if not entry[1]:
+                del self.buckets[bucket]
+
+    async def dispatch(self, jobs: list) -> list:
+        results = await asyncio.gather(
+            *(self._run(bucket, f) for (_, bucket, f) in jobs), return_exceptions=True)
+        return [(label, result) for ((label, _, _), result) in zip(jobs, results) if isinstance(result, Exception)]
+
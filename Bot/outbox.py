@@ -0,0 +1,155 @@
+import aiohttp
+import asyncio
+import json
+import os
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Optional
+from game import Game
+
+
+class OutboxRejected(Exception):
+    pass
+
+
+# The bot can stop after a create reached the api but before its ack was
+# written. Creates are stamped with their date when queued, and a restored
+# create first looks for a recent game with the same date and teams instead of
+# posting it a second time.
+RECONCILE_LIMIT = 50
+
+
+class Outbox:
+    def __init__(self, api, path: str, retry_delay: float = 5, max_retry_delay: float = 300):
+        self.api = api
+        self.path = path
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.entries = deque()
+        self.seq = 0
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.on_applied = None
+        self.on_rejected = None
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        entries = {}
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "ack" in record:
+                    entries.pop(record["ack"], None)
+                else:
+                    record["detached"] = True
+                    record["restored"] = True
+                    entries[record["seq"]] = record
+                    self.seq = max(self.seq, record["seq"])
+        self.entries.extend(entries[x] for x in sorted(entries))
+
+    def _append(self, record: dict) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self) -> None:
+        with open(self.path, "w"):
+            pass
+
+    def start(self) -> None:
+        if self.entries and (self.task is None or self.task.done()):
+            self.task = asyncio.ensure_future(self._retry())
+
+    async def create_game(self, game: Game, meta: dict = None) -> Optional[Game]:
+        return await self._submit("create", game, meta)
+
+    async def update_game(self, game: Game, meta: dict = None) -> Optional[Game]:
+        return await self._submit("update", game, meta)
+
+    async def _submit(self, op: str, game: Game, meta: dict) -> Optional[Game]:
+        if op == "create" and not game.date:
+            game = game.copy()
+            game.date = datetime.utcnow().replace(microsecond=0).isoformat()
+        self.seq += 1
+        entry = {"seq": self.seq, "op": op,
+                 "game": game.to_dict(), "meta": meta or {}}
+        self._append(entry)
+        self.entries.append(entry)
+        await self.flush()
+        if "error" in entry:
+            raise OutboxRejected(entry["error"])
+        if "result" in entry:
+            return entry["result"]
+        entry["detached"] = True
+        self.start()
+        return None
+
+    async def flush(self) -> bool:
+        applied = []
+        try:
+            async with self.lock:
+                return await self._flush(applied)
+        finally:
+            # Callbacks may take a while (a full rating rebuild), so they run
+            # once the lock is released and other writes can go through.
+            for entry in applied:
+                try:
+                    if "error" in entry:
+                        await self.on_rejected(entry["op"], Game.from_dict(entry["game"]), entry["meta"], entry["error"])
+                    else:
+                        await self.on_applied(entry["op"], entry["result"], entry["meta"])
+                except Exception:
+                    traceback.print_exc()
+
+    async def _flush(self, applied: list) -> bool:
+        while self.entries:
+            entry = self.entries[0]
+            game = Game.from_dict(entry["game"])
+            try:
+                entry["result"] = await self._send(entry, game)
+            except aiohttp.ClientResponseError as e:
+                if e.status >= 500:
+                    return False
+                print(f"Dropping rejected {entry['op']} of game {game.id}: {e!r}")
+                entry["error"] = f"{e.status} {e.message}"
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+            self.entries.popleft()
+            self._append({"ack": entry["seq"]})
+            if not self.entries:
+                self._compact()
+            if entry.get("detached") and self.on_applied is not None and self.on_rejected is not None:
+                applied.append(entry)
+        return True
+
+    async def _send(self, entry: dict, game: Game) -> Game:
+        if entry["op"] == "update":
+            return await self.api.update_game(game)
+        if entry.get("restored") and game.date:
+            created = await self._find_created(game)
+            if created is not None:
+                print(f"Game {created.id} was already created")
+                return created
+        return await self.api.create_game(game)
+
+    async def _find_created(self, game: Game) -> Optional[Game]:
+        teams = (sorted(game.team1), sorted(game.team2))
+        for x in await self.api.get_games(limit=RECONCILE_LIMIT, newest_first=True):
+            if x.date and x.date[:19] == game.date[:19] and (sorted(x.team1), sorted(x.team2)) == teams:
+                return x
+        return None
+
+    async def _retry(self) -> None:
+        delay = self.retry_delay
+        while self.entries:
+            await asyncio.sleep(delay)
+            if await self.flush():
+                return
+            delay = min(2 * delay, self.max_retry_delay)
@@ -1,27 +1,61 @@
 import trueskill
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
 
 env = trueskill.TrueSkill(mu=2500, sigma=2500/3,
                           beta=2500/6, tau=25, draw_probability=0.085)
-DEFAULT_RATING = env.create_rating()
+Rating = namedtuple("Rating", ["mu", "sigma"])
+DEFAULT_RATING = Rating(env.mu, env.sigma)
 
 
 class Player:
+    __slots__ = ("rating", "wins", "losses", "draws", "game_ids", "ratings")
+
     def __init__(self, rating=DEFAULT_RATING):
         self.rating = rating
         self.wins = 0
         self.losses = 0
         self.draws = 0
-        self.history = []
+        self.game_ids = array("q")
+        self.ratings = array("d")
+
+    def to_dict(self) -> dict:
+        return {
+            "mu": self.rating.mu,
+            "sigma": self.rating.sigma,
+            "wins": self.wins,
+            "losses": self.losses,
+            "draws": self.draws,
+            "game_ids": self.game_ids.tolist(),
+            "ratings": self.ratings.tolist(),
+        }
+
+    @staticmethod
+    def from_dict(d):
+        player = Player(Rating(d["mu"], d["sigma"]))
+        player.wins = d["wins"]
+        player.losses = d["losses"]
+        player.draws = d["draws"]
+        player.game_ids = array("q", d["game_ids"])
+        player.ratings = array("d", d["ratings"])
+        return player
 
     def conservative_rating(self):
         return self.rating.mu - 2 * self.rating.sigma
 
     def add_rating(self, game_id: int) -> None:
-        self.history.append((game_id, self.conservative_rating()))
+        self.game_ids.append(game_id)
+        self.ratings.append(self.conservative_rating())
+
+    def has_game(self, game_id: int) -> bool:
+        i = bisect_left(self.game_ids, game_id)
+        return i < len(self.game_ids) and self.game_ids[i] == game_id
 
     def rating_change(self, game_id):
-        previous_ratings = list(
-            filter(lambda x: x[0] <= game_id, self.history))[-2:]
-        if len(previous_ratings) < 2:
-            return previous_ratings[0][1] - Player().conservative_rating()
-        return previous_ratings[1][1] - previous_ratings[0][1]
+        i = bisect_right(self.game_ids, game_id)
+        if i == 0:
+            raise IndexError(game_id)
+        if i == 1:
+            return self.ratings[0] - Player().conservative_rating()
+        return self.ratings[i - 1] - self.ratings[i - 2]
@@ -0,0 +1,59 @@
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def render_history(ratings: list, games: int, ranks: list, title: str) -> bytes:
+    # matplotlib takes a noticeable time to import, so it is only loaded on
+    # the first render.
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    ys = list(ratings)
+    xs = [i for i in range(len(ys))]
+    if games is not None and len(ys) > games:
+        ys = ys[-games:]
+        xs = xs[-games:]
+    ymin = min(ys)
+    ymax = max(ys)
+    dy = 0.05 * (ymax - ymin)
+    ymin -= dy
+    ymax += dy
+    figure = Figure()
+    ax = figure.subplots()
+    alpha = 0.3
+    rating_min = 0
+    for rank in ranks:
+        rating_max = rank["limit"]
+        ax.axhspan(rating_min, rating_max, alpha=alpha, color=rank["color"])
+        rating_min = rating_max
+    ax.set_xticks(xs[::max(1, round(len(xs)/15))])
+    ax.set_ylim([ymin, ymax])
+    ax.grid()
+    ax.plot(xs, ys, "black")
+    ax.set_title(title)
+    ax.set_xlabel('game #')
+    ax.set_ylabel('rating')
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class HistoryPlotter:
+    def __init__(self, size: int = 64, workers: int = 2):
+        self.size = size
+        self.cache = OrderedDict()
+        self.executor = ThreadPoolExecutor(workers)
+
+    async def render(self, key, ratings: list, games: int, ranks: list, title: str) -> bytes:
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(
+            self.executor, render_history, ratings, games, ranks, title)
+        self.cache[key] = data
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return data
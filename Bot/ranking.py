@@ -0,0 +1,54 @@
+from bisect import bisect_left, insort
+from typing import Optional, List
+
+LEADERBOARD_PAGE_SIZE = 20
+
+
+class Ranking:
+    def __init__(self):
+        self.keys = []
+        self.ratings = {}
+
+    @staticmethod
+    def from_players(players: dict):
+        ranking = Ranking()
+        ranking.ratings = {k: v.conservative_rating()
+                           for k, v in players.items()}
+        ranking.keys = sorted((-v, k) for k, v in ranking.ratings.items())
+        return ranking
+
+    def update(self, player_id: int, rating: float) -> None:
+        self.remove(player_id)
+        self.ratings[player_id] = rating
+        insort(self.keys, (-rating, player_id))
+
+    def remove(self, player_id: int) -> None:
+        rating = self.ratings.pop(player_id, None)
+        if rating is not None:
+            del self.keys[bisect_left(self.keys, (-rating, player_id))]
+
+    def position(self, player_id: int) -> Optional[int]:
+        rating = self.ratings.get(player_id)
+        if rating is None:
+            return None
+        return bisect_left(self.keys, (-rating, player_id))
+
+    def page(self, page: int, size: int) -> List[int]:
+        return [x[1] for x in self.keys[page * size:(page + 1) * size]]
+
+    def __iter__(self):
+        return (x[1] for x in self.keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def format_leaderboard(entries: list, first: int) -> str:
+    description = ""
+    for (i, (name, player)) in enumerate(entries, first):
+        conservative_rating = player.conservative_rating()
+        mu = player.rating.mu
+        sigma = 2 * player.rating.sigma
+        description += "{}: {} - **{:.0f}** ({:.0f} ± {:.0f})\n".format(
+            i, name, conservative_rating, mu, sigma)
+    return description
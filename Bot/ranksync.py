@@ -0,0 +1,69 @@
+import asyncio
+import discord
+
+
+class RankSync:
+    def __init__(self, bot, state, dispatcher, chunk_size: int = 100, chunk_delay: float = 1):
+        self.bot = bot
+        self.state = state
+        self.dispatcher = dispatcher
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.targets = {}
+        self.reconciled = set()
+
+    def role_ids(self) -> set:
+        return {x["id"] for x in self.state.ranks if x["id"]}
+
+    def target(self, player_id: int):
+        player = self.state.get_player(player_id)
+        if player is None:
+            return None
+        rank = self.state.get_rank(player.conservative_rating())
+        return (rank["id"] or None) if rank else None
+
+    def reconcile(self) -> None:
+        self.reconciled = set()
+
+    async def run(self) -> None:
+        role_ids = self.role_ids()
+        if not role_ids:
+            return
+        targets = {x: self.target(x) for x in self.state.players}
+        changed = [k for (k, v) in targets.items()
+                   if k not in self.targets or self.targets[k] != v]
+        self.targets = targets
+        for guild in self.bot.guilds:
+            if guild.id in self.reconciled:
+                members = [guild.get_member(x) for x in changed]
+                await self.apply(guild, [x for x in members if x], role_ids)
+                continue
+            members = guild.members
+            for start in range(0, len(members), self.chunk_size):
+                if start:
+                    await asyncio.sleep(self.chunk_delay)
+                await self.apply(guild, members[start:start+self.chunk_size], role_ids)
+            self.reconciled.add(guild.id)
+
+    async def apply(self, guild: discord.Guild, members: list, role_ids: set) -> None:
+        jobs = []
+        for member in members:
+            target = self.target(member.id)
+            current = {x.id for x in member.roles} & role_ids
+            add = [guild.get_role(x) for x in {target} - current if x]
+            remove = [guild.get_role(x) for x in current - {target}]
+            add = [x for x in add if x]
+            remove = [x for x in remove if x]
+            if add or remove:
+                jobs.append((member.id, member.id,
+                             lambda member=member, add=add, remove=remove: update_roles(member, add, remove)))
+        for (member_id, e) in await self.dispatcher.dispatch(jobs):
+            print(f"Could not update rank roles of {member_id}: {e!r}")
+            self.targets.pop(member_id, None)
+
+
+async def update_roles(member: discord.Member, add: list, remove: list) -> None:
+    if remove:
+        await member.remove_roles(*remove, reason="Rank changed")
+    if add:
+        await member.add_roles(*add, reason="Rank changed")
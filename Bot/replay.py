@@ -0,0 +1,96 @@
+import math
+from array import array
+from functools import lru_cache
+import trueskill
+from game import Game, Result
+from player import Player, Rating, env
+
+TAU2 = env.tau ** 2
+BETA2 = env.beta ** 2
+
+
+@lru_cache(maxsize=None)
+def draw_margin(size: int) -> float:
+    return trueskill.calc_draw_margin(env.draw_probability, size, env)
+
+
+def rate_teams(mus1: list, sigmas1: list, mus2: list, sigmas2: list, score: Result) -> tuple:
+    vars1 = [x * x + TAU2 for x in sigmas1]
+    vars2 = [x * x + TAU2 for x in sigmas2]
+    size = len(mus1) + len(mus2)
+    c2 = sum(vars1) + sum(vars2) + size * BETA2
+    c = math.sqrt(c2)
+    margin = draw_margin(size) / c
+    diff = (sum(mus1) - sum(mus2)) / c
+    if score == Result.TEAM1:
+        sign = 1
+        v = env.v_win(diff, margin)
+        w = env.w_win(diff, margin)
+    elif score == Result.TEAM2:
+        sign = -1
+        v = env.v_win(-diff, margin)
+        w = env.w_win(-diff, margin)
+    else:
+        sign = 1
+        v = env.v_draw(diff, margin)
+        w = env.w_draw(diff, margin)
+    v *= sign / c
+    w /= c2
+    mus1 = [mu + var * v for (mu, var) in zip(mus1, vars1)]
+    mus2 = [mu - var * v for (mu, var) in zip(mus2, vars2)]
+    sigmas1 = [math.sqrt(var * (1 - var * w)) for var in vars1]
+    sigmas2 = [math.sqrt(var * (1 - var * w)) for var in vars2]
+    return mus1, sigmas1, mus2, sigmas2
+
+
+class Replayer:
+    def __init__(self, players: dict = None):
+        self.players = {} if players is None else players
+        self.slots = {}
+        self.mus = array("d")
+        self.sigmas = array("d")
+
+    def slot(self, player_id: int) -> int:
+        slot = self.slots.get(player_id)
+        if slot is None:
+            player = self.players.get(player_id)
+            if player is None:
+                player = self.players[player_id] = Player()
+            slot = self.slots[player_id] = len(self.mus)
+            self.mus.append(player.rating.mu)
+            self.sigmas.append(player.rating.sigma)
+        return slot
+
+    def rate(self, game: Game) -> None:
+        if not game.score.is_rated():
+            return
+        mus, sigmas = self.mus, self.sigmas
+        slots1 = [self.slot(x) for x in game.team1]
+        slots2 = [self.slot(x) for x in game.team2]
+        mus1, sigmas1, mus2, sigmas2 = rate_teams(
+            [mus[x] for x in slots1], [sigmas[x] for x in slots1],
+            [mus[x] for x in slots2], [sigmas[x] for x in slots2], game.score)
+        for (team, player_ids, slots, new_mus, new_sigmas) in [
+                (Result.TEAM1, game.team1, slots1, mus1, sigmas1),
+                (Result.TEAM2, game.team2, slots2, mus2, sigmas2)]:
+            for (player_id, slot, mu, sigma) in zip(player_ids, slots, new_mus, new_sigmas):
+                mus[slot] = mu
+                sigmas[slot] = sigma
+                player = self.players[player_id]
+                if game.score == Result.DRAW:
+                    player.draws += 1
+                elif game.score == team:
+                    player.wins += 1
+                else:
+                    player.losses += 1
+                player.game_ids.append(game.id)
+                player.ratings.append(mu - 2 * sigma)
+
+    def finish(self) -> dict:
+        for (player_id, slot) in self.slots.items():
+            self.players[player_id].rating = Rating(
+                self.mus[slot], self.sigmas[slot])
+        self.slots = {}
+        self.mus = array("d")
+        self.sigmas = array("d")
+        return self.players
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+from typing import Optional
+from game import Game
+from player import Player, Rating, env
+
+SNAPSHOT_VERSION = 4
+EMPTY_DIGEST = hashlib.sha256(json.dumps(
+    [env.mu, env.sigma, env.beta, env.tau, env.draw_probability]).encode()).hexdigest()
+
+
+def chain_digest(digest: str, game: Game) -> str:
+    # The api does not keep the order of players within a team.
+    data = json.dumps([digest, game.id, game.score.value,
+                       sorted(game.team1), sorted(game.team2)])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def journal_path(path: str) -> str:
+    return f"{path}.journal"
+
+
+class Snapshot:
+    def __init__(self, players: dict, last_game_id: int, digest: str):
+        self.players = players
+        self.last_game_id = last_game_id
+        self.digest = digest
+
+    def save(self, path: str) -> None:
+        d = {
+            "version": SNAPSHOT_VERSION,
+            "last_game_id": self.last_game_id,
+            "digest": self.digest,
+            "players": {str(k): v.to_dict() for k, v in self.players.items()},
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(d, f)
+        os.replace(tmp, path)
+        with open(journal_path(path), "w"):
+            pass
+
+    @staticmethod
+    def journal_entry(players: dict, game: Game, previous: str, digest: str) -> dict:
+        return {
+            "game_id": game.id,
+            "previous": previous,
+            "digest": digest,
+            "players": {str(x): {"mu": players[x].rating.mu,
+                                 "sigma": players[x].rating.sigma,
+                                 "wins": players[x].wins,
+                                 "losses": players[x].losses,
+                                 "draws": players[x].draws}
+                        for x in game.team1 + game.team2},
+        }
+
+    @staticmethod
+    def append(path: str, entries: list) -> None:
+        with open(journal_path(path), "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    def replay_journal(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                # Entries written on top of an older base do not chain onto
+                # this one and are skipped.
+                if entry["previous"] != self.digest:
+                    continue
+                for (k, v) in entry["players"].items():
+                    player = self.players.setdefault(int(k), Player())
+                    player.rating = Rating(v["mu"], v["sigma"])
+                    player.wins = v["wins"]
+                    player.losses = v["losses"]
+                    player.draws = v["draws"]
+                    player.add_rating(entry["game_id"])
+                self.last_game_id = entry["game_id"]
+                self.digest = entry["digest"]
+
+    @staticmethod
+    def load(path: str) -> Optional["Snapshot"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                d = json.load(f)
+            if d["version"] != SNAPSHOT_VERSION:
+                return None
+            players = {int(k): Player.from_dict(v)
+                       for k, v in d["players"].items()}
+            snapshot = Snapshot(players, d["last_game_id"], d["digest"])
+            snapshot.replay_journal(journal_path(path))
+            return snapshot
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Could not load rating snapshot: {e!r}")
+            return None
@@ -1,82 +1,222 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from api import Api
+from cache import CachedApi
+from coalesce import Coalescer
 from game import Game, Result
-from player import Player, env
+from lobby import Lobby
+from outbox import Outbox
+from player import Player, DEFAULT_RATING
+from replay import Replayer
+from ranking import Ranking
+from stats import Stats
+from snapshot import Snapshot, EMPTY_DIGEST, chain_digest
 from typing import Optional
-import trueskill
 
 
 class State:
     def __init__(self, config: dict):
-        self.api = Api(config["api"])
+        cache = config.get("cache", {})
+        api = Api(config["api"], config.get("api_timeout", 10),
+                  page_size=config.get("api_page_size", 1000))
+        self.api = CachedApi(api, cache.get("size", 256), cache.get("ttl", 300))
+        self.outbox = Outbox(self.api, config.get("outbox", "outbox.jsonl"))
         self.channels = config["channels"]
         self.roles = config["roles"]
         self.ranks = config["ranks"]
+        self.balance_options = config.get("balance", {})
         self.players = {}
-        self.queue = set()
-        self.team_size = 4
-        self.frozen = False
-        self.leaderboard = []
-
-    def update_players(self) -> None:
-        games = self.api.get_games()
-        players = {}
-        for game in games:
-            update_ratings(players, game)
+        self.ranking = Ranking()
+        self.stats = Stats()
+        self.last_game_id = 0
+        self.generation = 0
+        self.digest = EMPTY_DIGEST
+        self.snapshot_path = config.get("snapshot", "ratings.json")
+        self.lobbies = {}
+        self.lobby_scope = config.get("lobby_scope", "channel")
+        self.team_size = config.get("team_size", 4)
+        self.leaderboard = {}
+        self.members = {}
+        self.rankings = {}
+        self.executor = ThreadPoolExecutor(1)
+        self.rebuilder = Coalescer(self.rebuild)
+        self.rebuilding = False
+        self.stale = False
+        self.journal = []
+        self.journal_writer = Coalescer(
+            self.flush_journal, config.get("snapshot_delay", 1))
+
+    async def load(self) -> None:
+        games = await self.api.get_games()
+        await self.build(games, True)
+
+    async def update_players(self) -> None:
+        self.rebuilder.trigger()
+        await self.rebuilder.wait()
+
+    async def rebuild(self) -> None:
+        self.rebuilding = True
+        try:
+            games = await self.api.get_games()
+            await self.build(games)
+            self.stale = False
+        except:
+            # Stats may already include the change that triggered the rebuild,
+            # so incremental updates wait for the next successful rebuild.
+            self.stale = True
+            raise
+        finally:
+            self.rebuilding = False
+
+    async def build(self, games: list, use_snapshot: bool = False) -> None:
+        # The replay runs on a private copy of the game list in a worker
+        # thread; commands keep reading the previous players until the swap.
+        loop = asyncio.get_running_loop()
+        stats, players, last_game_id, digest = await loop.run_in_executor(
+            self.executor, build, tuple(games), self.snapshot_path, use_snapshot)
+        self.stats = stats
         self.players = players
+        self.generation += 1
+        self.ranking = Ranking.from_players(players)
+        for key in self.members:
+            self.rank_members(key)
+        self.last_game_id = last_game_id
+        self.digest = digest
+        self.refresh_lobbies()
+
+    def game_created(self, game: Game) -> None:
+        self.stats.add(game)
+        if self.rebuilding:
+            self.rebuilder.trigger()
+
+    async def game_updated(self, game: Game, previous_score: Result) -> None:
+        self.stats.add(game)
+        if previous_score.is_rated() or self.rebuilding or self.stale:
+            await self.update_players()
+        elif game.score.is_rated():
+            if game.id > self.last_game_id:
+                update_ratings(self.players, game)
+                self.update_rankings(game.team1 + game.team2)
+                previous = self.digest
+                self.last_game_id = game.id
+                self.digest = chain_digest(self.digest, game)
+                self.refresh_lobbies()
+                self.journal.append(Snapshot.journal_entry(
+                    self.players, game, previous, self.digest))
+                self.journal_writer.trigger()
+            else:
+                await self.update_players()
+
+    async def flush_journal(self) -> None:
+        entries = self.journal
+        self.journal = []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self.executor, Snapshot.append, self.snapshot_path, entries)
+        except OSError as e:
+            print(f"Could not save rating snapshot: {e!r}")
+
+    def get_lobby(self, guild_id: int, channel_id: int) -> Lobby:
+        key = guild_id if self.lobby_scope == "guild" else channel_id
+        lobby = self.lobbies.get(key)
+        if lobby is None:
+            lobby = self.lobbies[key] = Lobby(
+                self.team_size, self.balance_options)
+        return lobby
+
+    def refresh_lobbies(self) -> None:
+        for lobby in self.lobbies.values():
+            lobby.set_ratings({x: self.get_rating(x) for x in lobby.queue})
 
-    def add_queue(self, player_id: int) -> None:
-        if player_id in self.queue:
-            raise KeyError
-        self.queue.add(player_id)
+    # Member sets are keyed by (guild id, ranked only) and each has a Ranking
+    # restricted to its members, so leaderboard pages and positions do not
+    # have to filter the global ranking.
+    def set_members(self, key: tuple, member_ids) -> None:
+        self.members[key] = set(member_ids)
+        self.rank_members(key)
 
-    def remove_queue(self, player_id: int) -> None:
-        self.queue.remove(player_id)
+    def rank_members(self, key: tuple) -> None:
+        self.rankings[key] = Ranking.from_players(
+            {x: self.players[x] for x in self.members[key] if x in self.players})
+
+    def set_member(self, key: tuple, member_id: int, present: bool) -> bool:
+        members = self.members.setdefault(key, set())
+        if present == (member_id in members):
+            return False
+        ranking = self.get_ranking(*key)
+        if present:
+            members.add(member_id)
+            player = self.players.get(member_id)
+            if player is not None:
+                ranking.update(member_id, player.conservative_rating())
+        else:
+            members.discard(member_id)
+            ranking.remove(member_id)
+        return True
+
+    def get_ranking(self, guild_id: int, ranked_only: bool = True) -> Ranking:
+        return self.rankings.setdefault((guild_id, ranked_only), Ranking())
+
+    def update_rankings(self, player_ids: list) -> None:
+        for player_id in player_ids:
+            rating = self.players[player_id].conservative_rating()
+            self.ranking.update(player_id, rating)
+            for (key, members) in self.members.items():
+                if player_id in members:
+                    self.rankings[key].update(player_id, rating)
 
     def get_player(self, player_id: int) -> Optional[Player]:
         return self.players.get(player_id)
 
+    def get_rating(self, player_id: int):
+        player = self.players.get(player_id)
+        return player.rating if player is not None else DEFAULT_RATING
+
     def get_rank(self, rating) -> str:
         for rank in self.ranks:
             if rating < rank["limit"]:
                 return rank
 
 
+def replay(games: list, players: dict = None, last_game_id: int = 0, digest: str = EMPTY_DIGEST) -> tuple:
+    replayer = Replayer(players)
+    for game in games:
+        replayer.rate(game)
+        if game.score.is_rated():
+            last_game_id = max(last_game_id, game.id)
+            digest = chain_digest(digest, game)
+    return replayer.finish(), last_game_id, digest
+
+
+def build(games: list, path: str = None, use_snapshot: bool = False) -> tuple:
+    stats = Stats.from_games(games)
+    result = None
+    snapshot = Snapshot.load(path) if use_snapshot and path is not None else None
+    if snapshot is not None:
+        digest = EMPTY_DIGEST
+        for game in games:
+            if game.id <= snapshot.last_game_id and game.score.is_rated():
+                digest = chain_digest(digest, game)
+        if digest == snapshot.digest:
+            newer = [x for x in games if x.id > snapshot.last_game_id]
+            result = replay(newer, snapshot.players,
+                            snapshot.last_game_id, snapshot.digest)
+            if result[2] == snapshot.digest:
+                return (stats,) + result
+        else:
+            print("Rating snapshot is stale, rebuilding from scratch.")
+    if result is None:
+        result = replay(games)
+    if path is not None:
+        try:
+            Snapshot(*result).save(path)
+        except OSError as e:
+            print(f"Could not save rating snapshot: {e!r}")
+    return (stats,) + result
+
+
 def update_ratings(players: dict, game: Game) -> None:
-    if game.score == Result.TEAM1:
-        ranks = [0, 1]
-    elif game.score == Result.TEAM2:
-        ranks = [1, 0]
-    elif game.score == Result.DRAW:
-        ranks = [0, 0]
-    else:
-        return
-    for player_id in game.team1:
-        if not player_id in players:
-            players[player_id] = Player()
-        if game.score == Result.TEAM1:
-            players[player_id].wins += 1
-        elif game.score == Result.TEAM2:
-            players[player_id].losses += 1
-        elif game.score == Result.DRAW:
-            players[player_id].draws += 1
-    for player_id in game.team2:
-        if not player_id in players:
-            players[player_id] = Player()
-        if game.score == Result.TEAM1:
-            players[player_id].losses += 1
-        elif game.score == Result.TEAM2:
-            players[player_id].wins += 1
-        elif game.score == Result.DRAW:
-            players[player_id].draws += 1
-
-    def get_rating(x): return players[x].rating
-    team1_ratings = list(map(get_rating, game.team1))
-    team2_ratings = list(map(get_rating, game.team2))
-    team1_ratings, team2_ratings = env.rate(
-        [team1_ratings, team2_ratings], ranks=ranks)
-    for i, player in enumerate(game.team1):
-        players[player].rating = team1_ratings[i]
-    for i, player in enumerate(game.team2):
-        players[player].rating = team2_ratings[i]
-    for player in game.team1 + game.team2:
-        players[player].add_rating(game.id)
+    replayer = Replayer(players)
+    replayer.rate(game)
+    replayer.finish()
@@ -0,0 +1,134 @@
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime
+from typing import List
+from game import Game, Result
+
+
+def game_day(game: Game) -> str:
+    return game.date[:10] if game.date else None
+
+
+def game_week(game: Game) -> str:
+    if not game.date:
+        return None
+    year, week, _ = datetime.fromisoformat(game.date[:10]).isocalendar()
+    return f"{year}-W{week:02}"
+
+
+class Stats:
+    def __init__(self):
+        self.games = {}
+        self.results = Counter()
+        self.days = Counter()
+        self.weeks = Counter()
+        self.teams = {}
+        self.player_games = {}
+
+    @staticmethod
+    def from_games(games: List[Game]):
+        stats = Stats()
+        for game in games:
+            stats.add(game)
+        return stats
+
+    def add(self, game: Game) -> None:
+        self.remove(game.id)
+        day = game_day(game)
+        week = game_week(game)
+        self.games[game.id] = (game.score, day, week)
+        self.results[game.score] += 1
+        self.days[day] += 1
+        self.weeks[week] += 1
+        self.teams[game.id] = (tuple(game.team1), tuple(game.team2))
+        for player_id in game.team1 + game.team2:
+            insort(self.player_games.setdefault(player_id, []), game.id)
+
+    def remove(self, game_id: int) -> None:
+        entry = self.games.pop(game_id, None)
+        if entry is None:
+            return
+        score, day, week = entry
+        self.results[score] -= 1
+        self.days[day] -= 1
+        self.weeks[week] -= 1
+        team1, team2 = self.teams.pop(game_id)
+        for player_id in team1 + team2:
+            game_ids = self.player_games[player_id]
+            del game_ids[bisect_left(game_ids, game_id)]
+            if not game_ids:
+                del self.player_games[player_id]
+
+    def games_of(self, player_id: int, limit: int = None) -> List[int]:
+        game_ids = self.player_games.get(player_id, [])
+        if limit is not None:
+            game_ids = game_ids[-limit:]
+        return game_ids[::-1]
+
+    def outcome(self, game_id: int, player_id: int) -> str:
+        score = self.games[game_id][0]
+        if score == Result.DRAW:
+            return "draw"
+        elif score == Result.CANCELLED:
+            return "cancelled"
+        elif score == Result.UNDECIDED:
+            return "undecided"
+        team = Result.TEAM1 if player_id in self.teams[game_id][0] else Result.TEAM2
+        return "win" if score == team else "loss"
+
+    def iter_outcomes(self, player_id: int):
+        for game_id in reversed(self.player_games.get(player_id, [])):
+            if self.games[game_id][0].is_rated():
+                yield self.outcome(game_id, player_id)
+
+    def streak(self, player_id: int):
+        outcomes = self.iter_outcomes(player_id)
+        current = next(outcomes, None)
+        length = 0 if current is None else 1
+        for outcome in outcomes:
+            if outcome != current:
+                break
+            length += 1
+        return current, length
+
+    def form(self, player_id: int, games: int = 10) -> List[str]:
+        return [x for (_, x) in zip(range(games), self.iter_outcomes(player_id))]
+
+    def total(self) -> int:
+        return len(self.games)
+
+    def played(self) -> int:
+        return sum(v for (k, v) in self.results.items() if k.is_rated())
+
+    def verify(self, games: List[Game], players: dict) -> List[str]:
+        errors = []
+        expected = Stats.from_games(games)
+        for name in ["results", "days", "weeks"]:
+            actual = getattr(self, name)
+            counts = getattr(expected, name)
+            for key in sorted(+actual | +counts, key=str):
+                if actual[key] != counts[key]:
+                    label = key.name if isinstance(key, Result) else key
+                    errors.append(
+                        f"{name} {label}: {actual[key]} != {counts[key]}")
+        records = {}
+        for game in games:
+            if not game.score.is_rated():
+                continue
+            for (team, player_ids) in [(Result.TEAM1, game.team1), (Result.TEAM2, game.team2)]:
+                for player_id in player_ids:
+                    record = records.setdefault(player_id, [0, 0, 0])
+                    if game.score == Result.DRAW:
+                        record[2] += 1
+                    elif game.score == team:
+                        record[0] += 1
+                    else:
+                        record[1] += 1
+        for player_id in records.keys() | players.keys():
+            player = players.get(player_id)
+            actual = [player.wins, player.losses,
+                      player.draws] if player else [0, 0, 0]
+            if actual != records.get(player_id, [0, 0, 0]):
+                errors.append(
+                    f"<@{player_id}>: W/L/D {actual} != {records.get(player_id)}")
+        return errors
@@ -0,0 +1,51 @@
+import random
+import pytest
+from balance import balance, partial_sums
+from benchmark import random_ratings, reference_balance
+from player import env
+
+
+def check(queue: list, ratings: dict):
+    teams, score = balance(queue, [ratings[x].mu for x in queue],
+                           [ratings[x].sigma for x in queue])
+    reference_teams, reference_score = reference_balance(queue, ratings)
+    assert teams == reference_teams
+    assert score == pytest.approx(reference_score, rel=1e-9)
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 5, 6])
+def test_balance_matches_reference(size):
+    rng = random.Random(size)
+    for _ in range(20):
+        ratings = random_ratings(rng, 2 * size)
+        check(list(ratings), ratings)
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 5, 6])
+def test_balance_with_default_ratings(size):
+    ratings = {x: env.create_rating() for x in range(2 * size)}
+    check(list(ratings), ratings)
+
+
+def test_local_search_keeps_team_sizes():
+    ratings = random_ratings(random.Random(0), 24)
+    queue = list(ratings)
+    (team1, team2), score = balance(queue, [ratings[x].mu for x in queue],
+                                    [ratings[x].sigma for x in queue],
+                                    exact_max_team_size=4)
+    assert len(team1) == len(team2) == 12
+    assert sorted(team1 + team2) == sorted(queue)
+    assert 0 < score <= 1
+
+
+@pytest.mark.parametrize("size", [2, 4, 8])
+def test_partial_sums_give_the_same_split(size):
+    ratings = random_ratings(random.Random(size), 2 * size)
+    queue = list(ratings)
+    mus = [ratings[x].mu for x in queue]
+    sigmas = [ratings[x].sigma for x in queue]
+    teams, score = balance(queue, mus, sigmas,
+                           partial=partial_sums(mus[:-1], size))
+    expected_teams, expected_score = balance(queue, mus, sigmas)
+    assert teams == expected_teams
+    assert score == pytest.approx(expected_score, rel=1e-12)
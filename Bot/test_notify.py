@@ -0,0 +1,25 @@
+import asyncio
+from notify import Dispatcher
+
+
+def test_dispatch_keeps_buckets_serial_and_prunes_them():
+    dispatcher = Dispatcher(concurrency=4, rate=1000)
+    running = {}
+    order = []
+
+    def job(bucket, i):
+        async def f():
+            running[bucket] = running.get(bucket, 0) + 1
+            assert running[bucket] == 1
+            await asyncio.sleep(0)
+            order.append((bucket, i))
+            running[bucket] -= 1
+            if i == 3:
+                raise ValueError(i)
+        return f
+
+    jobs = [(i, i % 2, job(i % 2, i)) for i in range(6)]
+    failures = asyncio.run(dispatcher.dispatch(jobs))
+    assert [(label, type(e)) for (label, e) in failures] == [(3, ValueError)]
+    assert sorted(order) == sorted((i % 2, i) for i in range(6))
+    assert dispatcher.buckets == {}
@@ -0,0 +1,135 @@
+import aiohttp
+import asyncio
+import json
+import pytest
+from game import Game, Result
+from outbox import Outbox, OutboxRejected
+
+
+class FakeApi:
+    def __init__(self):
+        self.games = []
+        self.calls = []
+        self.error = None
+
+    def fail(self):
+        if self.error is not None:
+            raise self.error
+
+    async def create_game(self, game):
+        self.fail()
+        game = game.copy()
+        game.id = len(self.games) + 1
+        self.games.append(game)
+        self.calls.append(("create", game.id))
+        return game.copy()
+
+    async def update_game(self, game):
+        self.fail()
+        self.games[game.id - 1] = game.copy()
+        self.calls.append(("update", game.id))
+        return game.copy()
+
+    async def get_games(self, player_id=None, after_id=None, limit=None, newest_first=False):
+        self.fail()
+        games = self.games[::-1] if newest_first else self.games
+        return [x.copy() for x in games[:limit]]
+
+
+def rejected(status):
+    return aiohttp.ClientResponseError(None, (), status=status, message="Bad Request")
+
+
+def make_outbox(tmp_path, api, events):
+    outbox = Outbox(api, str(tmp_path / "outbox.jsonl"), retry_delay=0)
+
+    async def on_applied(op, game, meta):
+        assert not outbox.lock.locked()
+        events.append(("applied", op, game.id, meta))
+
+    async def on_rejected(op, game, meta, error):
+        assert not outbox.lock.locked()
+        events.append(("rejected", op, game.id, meta))
+
+    outbox.on_applied = on_applied
+    outbox.on_rejected = on_rejected
+    return outbox
+
+
+def test_writes_are_applied_in_order_once_the_api_recovers(tmp_path):
+    api = FakeApi()
+    events = []
+    outbox = make_outbox(tmp_path, api, events)
+
+    async def run():
+        created = await outbox.create_game(Game([1, 2], [3, 4]), {"lobby": 1})
+        assert created.id == 1
+        api.error = aiohttp.ClientConnectionError()
+        assert await outbox.create_game(Game([5, 6], [7, 8]), {"lobby": 2}) is None
+        assert await outbox.update_game(Game([1, 2], [3, 4], 1, Result.TEAM1)) is None
+        api.error = rejected(503)
+        assert not await outbox.flush()
+        api.error = None
+        assert await outbox.flush()
+
+    asyncio.run(run())
+    assert api.calls == [("create", 1), ("create", 2), ("update", 1)]
+    assert events == [("applied", "create", 2, {"lobby": 2}),
+                      ("applied", "update", 1, {})]
+    assert not outbox.entries
+    assert (tmp_path / "outbox.jsonl").read_text() == ""
+
+
+def test_rejected_writes_are_dropped(tmp_path):
+    api = FakeApi()
+    events = []
+    outbox = make_outbox(tmp_path, api, events)
+
+    async def run():
+        api.error = rejected(400)
+        with pytest.raises(OutboxRejected):
+            await outbox.update_game(Game([1, 2], [3, 4], 7, Result.TEAM1))
+        api.error = aiohttp.ClientConnectionError()
+        await outbox.create_game(Game([1, 2], [3, 4]), {"lobby": 1})
+        api.error = rejected(400)
+        assert await outbox.flush()
+
+    asyncio.run(run())
+    assert events == [("rejected", "create", None, {"lobby": 1})]
+    assert not outbox.entries
+    assert api.calls == []
+
+
+def test_reload_only_replays_unacked_writes(tmp_path):
+    api = FakeApi()
+    events = []
+    outbox = make_outbox(tmp_path, api, events)
+
+    async def submit():
+        await outbox.create_game(Game([1, 2], [3, 4]))
+        api.error = aiohttp.ClientConnectionError()
+        await outbox.update_game(Game([1, 2], [3, 4], 1, Result.TEAM2), {"channel": 9})
+
+    asyncio.run(submit())
+    api.error = None
+    reloaded = make_outbox(tmp_path, api, events)
+    assert [x["op"] for x in reloaded.entries] == ["update"]
+    assert asyncio.run(reloaded.flush())
+    assert api.calls == [("create", 1), ("update", 1)]
+    assert events == [("applied", "update", 1, {"channel": 9})]
+    assert not make_outbox(tmp_path, api, events).entries
+
+
+def test_reload_does_not_create_a_game_twice(tmp_path):
+    api = FakeApi()
+    events = []
+    game = Game([3, 1], [2, 4], date="2021-01-01T12:00:00")
+    asyncio.run(api.create_game(Game([1, 3], [2, 4], date="2021-01-01T12:00:00")))
+    # The create reached the api, but the bot stopped before writing its ack.
+    (tmp_path / "outbox.jsonl").write_text(json.dumps(
+        {"seq": 1, "op": "create", "game": game.to_dict(), "meta": {"lobby": 1}}) + "\n")
+
+    outbox = make_outbox(tmp_path, api, events)
+    assert asyncio.run(outbox.flush())
+    assert api.calls == [("create", 1)]
+    assert events == [("applied", "create", 1, {"lobby": 1})]
@@ -0,0 +1,59 @@
+import random
+import pytest
+from game import Game, Result
+from player import env
+from replay import Replayer
+
+RANKS = {Result.TEAM1: [0, 1], Result.TEAM2: [1, 0], Result.DRAW: [0, 0]}
+
+
+def reference_replay(games: list) -> dict:
+    ratings = {}
+    for game in games:
+        if not game.score.is_rated():
+            continue
+        teams = [[ratings.get(x, env.create_rating()) for x in team]
+                 for team in (game.team1, game.team2)]
+        team1, team2 = env.rate(teams, ranks=RANKS[game.score])
+        ratings.update(zip(game.team1 + game.team2, team1 + team2))
+    return ratings
+
+
+def random_games(seed: int, players: int, games: int, sizes: list) -> list:
+    rng = random.Random(seed)
+    scores = [Result.TEAM1, Result.TEAM2, Result.DRAW, Result.CANCELLED]
+    history = []
+    for game_id in range(1, games + 1):
+        size1, size2 = rng.choice(sizes)
+        queue = rng.sample(range(1, players + 1), size1 + size2)
+        history.append(Game(queue[:size1], queue[size1:], game_id,
+                            rng.choice(scores), "2021-01-01T00:00:00"))
+    return history
+
+
+@pytest.mark.parametrize("sizes", [[(4, 4)], [(1, 1), (2, 2), (5, 5)], [(1, 2), (3, 4), (5, 2)]])
+def test_replay_matches_env_rate(sizes):
+    games = random_games(0, 30, 500, sizes)
+    replayer = Replayer()
+    for game in games:
+        replayer.rate(game)
+    players = replayer.finish()
+    reference = reference_replay(games)
+    assert {x for x in players if players[x].game_ids} == reference.keys()
+    for (player_id, rating) in reference.items():
+        assert players[player_id].rating.mu == pytest.approx(rating.mu, abs=1e-8)
+        assert players[player_id].rating.sigma == pytest.approx(rating.sigma, abs=1e-8)
+
+
+def test_replay_counts_results():
+    games = [Game([1, 2], [3, 4], 1, Result.TEAM1, ""),
+             Game([1, 3], [2, 4], 2, Result.DRAW, ""),
+             Game([1], [4, 2], 3, Result.TEAM2, ""),
+             Game([1, 2], [3, 4], 4, Result.CANCELLED, "")]
+    replayer = Replayer()
+    for game in games:
+        replayer.rate(game)
+    players = replayer.finish()
+    assert [(players[x].wins, players[x].losses, players[x].draws)
+            for x in (1, 2, 3, 4)] == [(1, 1, 1), (2, 0, 1), (0, 1, 1), (1, 1, 1)]
+    assert list(players[1].game_ids) == [1, 2, 3]
@@ -0,0 +1,190 @@
+import asyncio
+import random
+from benchmark import generate_games
+from game import Result
+from ranking import Ranking
+from snapshot import Snapshot
+from state import State, replay
+
+
+class FakeApi:
+    def __init__(self, games):
+        self.games = games
+
+    async def get_games(self, *args, **kwargs):
+        return [x.copy() for x in self.games]
+
+
+def make_state(tmp_path, games):
+    state = State({"api": "http://localhost", "channels": {}, "roles": {}, "ranks": [],
+                   "snapshot": str(tmp_path / "ratings.json"), "snapshot_delay": 0,
+                   "outbox": str(tmp_path / "outbox.jsonl")})
+    state.api = FakeApi(games)
+    return state
+
+
+def assert_same_players(actual, expected):
+    assert actual.keys() == expected.keys()
+    for player_id in expected:
+        assert actual[player_id].to_dict() == expected[player_id].to_dict()
+
+
+def test_incremental_scores_match_full_replay(tmp_path):
+    games = generate_games(random.Random(0), 40, 400)
+    scores = [x.score for x in games]
+    for game in games[200:]:
+        game.score = Result.UNDECIDED
+    state = make_state(tmp_path, games)
+
+    async def run():
+        await state.load()
+        for (game, score) in zip(games[200:], scores[200:]):
+            game.score = score
+            await state.game_updated(game.copy(), Result.UNDECIDED)
+        await state.journal_writer.wait()
+
+    asyncio.run(run())
+    assert state.generation == 1
+    players, last_game_id, digest = replay(games)
+    assert_same_players(state.players, players)
+    assert state.last_game_id == last_game_id
+    assert state.digest == digest
+    assert list(state.ranking) == list(Ranking.from_players(players))
+
+    snapshot = Snapshot.load(str(tmp_path / "ratings.json"))
+    assert_same_players(snapshot.players, players)
+    assert snapshot.digest == digest
+
+
+def test_rescoring_a_rated_game_rebuilds(tmp_path):
+    games = generate_games(random.Random(1), 20, 100,
+                           results={Result.TEAM1: 1})
+    state = make_state(tmp_path, games)
+
+    async def run():
+        await state.load()
+        games[10].score = Result.TEAM2
+        await state.game_updated(games[10].copy(), Result.TEAM1)
+
+    asyncio.run(run())
+    players, _, _ = replay(games)
+    assert_same_players(state.players, players)
+
+
+def test_failed_rebuild_reaches_caller(tmp_path):
+    games = generate_games(random.Random(2), 20, 100,
+                           results={Result.TEAM1: 1})
+    games[-1].score = Result.UNDECIDED
+    state = make_state(tmp_path, games)
+
+    async def fail(*args, **kwargs):
+        raise ConnectionError
+
+    async def run():
+        await state.load()
+        state.api.get_games = fail
+        games[10].score = Result.TEAM2
+        try:
+            await state.game_updated(games[10].copy(), Result.TEAM1)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("rebuild failure was swallowed")
+        assert state.stale
+        # The next score would normally be incremental, but the stats already
+        # hold the failed change, so it has to rebuild.
+        games[-1].score = Result.DRAW
+        state.api = FakeApi(games)
+        await state.game_updated(games[-1].copy(), Result.UNDECIDED)
+
+    asyncio.run(run())
+    assert not state.stale
+    players, _, _ = replay(games)
+    assert_same_players(state.players, players)
+
+
+def test_snapshot_survives_a_different_team_order(tmp_path, capsys):
+    games = generate_games(random.Random(3), 20, 100)
+    players, _, digest = replay(games)
+    asyncio.run(make_state(tmp_path, games).load())
+    for game in games:
+        game.team1.reverse()
+        game.team2.reverse()
+    state = make_state(tmp_path, games)
+    asyncio.run(state.load())
+    assert "stale" not in capsys.readouterr().out
+    assert_same_players(state.players, players)
+    assert state.digest == digest
+
+
+def test_reload_keeps_an_up_to_date_snapshot(tmp_path):
+    games = generate_games(random.Random(4), 20, 100)
+    scores = [x.score for x in games]
+    games[-1].score = Result.UNDECIDED
+    state = make_state(tmp_path, games)
+
+    async def run():
+        await state.load()
+        games[-1].score = scores[-1]
+        await state.game_updated(games[-1].copy(), Result.UNDECIDED)
+        await state.journal_writer.wait()
+
+    asyncio.run(run())
+    journal = (tmp_path / "ratings.json.journal").read_text()
+    assert journal
+    reloaded = make_state(tmp_path, games)
+    asyncio.run(reloaded.load())
+    assert (tmp_path / "ratings.json.journal").read_text() == journal
+    assert_same_players(reloaded.players, state.players)
+    assert reloaded.digest == state.digest
+
+
+def test_rescored_old_game_invalidates_the_snapshot(tmp_path, capsys):
+    games = generate_games(random.Random(5), 20, 100,
+                           results={Result.TEAM1: 1})
+    asyncio.run(make_state(tmp_path, games).load())
+    games[10].score = Result.TEAM2
+    state = make_state(tmp_path, games)
+    asyncio.run(state.load())
+    assert "stale" in capsys.readouterr().out
+    players, _, digest = replay(games)
+    assert_same_players(state.players, players)
+    assert Snapshot.load(str(tmp_path / "ratings.json")).digest == digest
+
+
+def test_unreadable_snapshot_is_rebuilt(tmp_path, capsys):
+    games = generate_games(random.Random(6), 20, 100)
+    (tmp_path / "ratings.json").write_text('{"version": 4, "players": {')
+    state = make_state(tmp_path, games)
+    asyncio.run(state.load())
+    assert "Could not load rating snapshot" in capsys.readouterr().out
+    players, _, digest = replay(games)
+    assert_same_players(state.players, players)
+    assert Snapshot.load(str(tmp_path / "ratings.json")).digest == digest
+
+
+def test_half_written_journal_line_is_ignored(tmp_path):
+    games = generate_games(random.Random(7), 20, 100,
+                           results={Result.TEAM1: 1})
+    for game in games[-2:]:
+        game.score = Result.UNDECIDED
+    state = make_state(tmp_path, games)
+
+    async def run():
+        await state.load()
+        for game in games[-2:]:
+            game.score = Result.TEAM2
+            await state.game_updated(game.copy(), Result.UNDECIDED)
+        await state.journal_writer.wait()
+
+    asyncio.run(run())
+    path = tmp_path / "ratings.json.journal"
+    journal = path.read_text()
+    path.write_text(journal[:-len(journal.splitlines()[-1]) // 2])
+    snapshot = Snapshot.load(str(tmp_path / "ratings.json"))
+    assert snapshot.last_game_id == games[-2].id
+    reloaded = make_state(tmp_path, games)
+    asyncio.run(reloaded.load())
+    players, _, digest = replay(games)
+    assert_same_players(reloaded.players, players)
+    assert reloaded.digest == digest